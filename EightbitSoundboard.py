@@ -31,6 +31,8 @@ class Soundboard():
             self.moveColorChange.remove(self.moveColorChange[i])
             self.moveColorChangeTimer.remove(self.moveColorChangeTimer[i])
         for move in sensorsChanged:
+            if not move.pressed:
+                continue
             self.playTileSound(move.row, move.col)
             self.moveColorChangeTimer.append(0)
             self.moveColorChange.append(move)
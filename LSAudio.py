@@ -1,19 +1,81 @@
 import pygame
 import random
+import os
+from collections import OrderedDict
+
+#decoded sounds, keyed by their file name under the sounds directory, like "8bit/10.wav"
+#holds at most capacity sounds and drops the one played longest ago to make room
+class SoundBank():
+    DIRECTORIES = ("", "8bit")
+    EXTENSIONS = (".wav", ".ogg")
+
+    def __init__(self, root = "sounds", capacity = 64):
+        self.root = root
+        self.capacity = capacity
+        self.volume = 1.0
+        self.sounds = OrderedDict()
+        self.missing = set()
+
+    #every sound file in the sounds directories
+    def names(self):
+        names = []
+        for directory in self.DIRECTORIES:
+            path = os.path.join(self.root, directory)
+            if not os.path.isdir(path):
+                continue
+            for fileName in sorted(os.listdir(path)):
+                if fileName.lower().endswith(self.EXTENSIONS):
+                    names.append(fileName if directory == "" else directory + "/" + fileName)
+        return names
+
+    #decodes the sounds now so the first play of each is as quick as the rest
+    def preload(self, names = None):
+        if names is None:
+            names = self.names()
+        for name in names[:self.capacity]:
+            self.get(name)
+
+    #returns the decoded sound, or None if it could not be loaded
+    def get(self, name):
+        sound = self.sounds.get(name)
+        if sound is not None:
+            self.sounds.move_to_end(name)
+            return sound
+        if name in self.missing:
+            return None
+        try:
+            sound = pygame.mixer.Sound(os.path.join(self.root, name))
+        except (pygame.error, IOError) as e:
+            print("Could not load sound " + name + ": " + str(e))
+            self.missing.add(name)
+            return None
+        sound.set_volume(self.volume)
+        self.sounds[name] = sound
+        while len(self.sounds) > self.capacity:
+            self.sounds.popitem(last = False)
+        return sound
+
+    def setVolume(self, vol):
+        self.volume = vol
+        for sound in self.sounds.values():
+            sound.set_volume(vol)
 
 #this class serves as a common controller for audio
 class Audio():
     SONG_END = pygame.USEREVENT + 1
 
-    def __init__(self):
+    def __init__(self, preload = True):
         pygame.mixer.init()
         pygame.init()
         self.loadedSongs = []
+        self.sounds = SoundBank()
+        if preload:
+            self.sounds.preload()
 
     def heartbeat(self):
-        for event in pygame.event.get():
-            if event.type == self.SONG_END:
-                self.shuffleSongs()
+        #only its own events, the emulator takes the mouse clicks
+        for event in pygame.event.get(self.SONG_END):
+            self.shuffleSongs()
 
     def loadSong(self, filename, name):
         #pygame.mixer.music.load("sounds/" + filename)
@@ -42,9 +104,9 @@ class Audio():
         pygame.mixer.music.set_endevent(self.SONG_END)
 
     def playSound(self, filename):
-        print("playing sound", filename)
-        sound = pygame.mixer.Sound("sounds/" + filename)
-        pygame.mixer.Sound.play(sound)
+        sound = self.sounds.get(filename)
+        if sound is not None:
+            sound.play()
         #pygame.mixer.music.load("sounds/" + filename)
         #pygame.mixer.music.play(1)
 
@@ -52,4 +114,4 @@ class Audio():
         pass
 
     def setSoundVolume(self, vol):
-        pygame.mixer.Sound.set_volume(1.0)
\ No newline at end of file
+        self.sounds.setVolume(vol)
\ No newline at end of file
@@ -0,0 +1,233 @@
+#!/usr/bin/python3
+'''
+LSCapture.py - records and replays the bytes on the Lightsweeper serial ports
+
+Usage:
+    LSCapture.py replay <file> [options]
+    LSCapture.py dump <file>
+    LSCapture.py -h | --help
+
+Options:
+    -p <port>           Replay to the serial port <port> instead of a simulated bus
+    -f --fast           Replay as fast as the port takes it instead of at the recorded pace
+    -h --help           Display this documentation
+'''
+
+import struct
+import threading
+import time
+
+# records are a header followed by length bytes of data
+# time is monotonic seconds, port is an index given by an earlier PORT record
+RECORD = struct.Struct('<dBBH')
+MAGIC = b'LSCAP1\n'
+WRITE = 0
+READ = 1
+PORT = 2
+
+
+class CaptureFile():
+    """
+        Append only binary log of the traffic on any number of ports.
+        Safe to share between port worker threads.
+    """
+
+    def __init__(self, fileName):
+        self.lock = threading.Lock()
+        self.ports = dict()     # port name -> index
+        self.file = open(fileName, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def record(self, portName, kind, data):
+        if len(data) == 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if portName not in self.ports:
+                self.ports[portName] = len(self.ports)
+                name = str(portName).encode('utf-8')
+                self.file.write(RECORD.pack(now, PORT, self.ports[portName], len(name)) + name)
+            self.file.write(RECORD.pack(now, kind, self.ports[portName], len(data)) + bytes(data))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class CaptureSerial():
+    """
+        Stands in for a pySerial port and logs every byte written and read
+    """
+
+    def __init__(self, mySerial, capture, name=None):
+        self.mySerial = mySerial
+        self.capture = capture
+        self.name = mySerial.port if name is None else name
+
+    def write(self, data):
+        count = self.mySerial.write(data)
+        self.capture.record(self.name, WRITE, data)
+        return count
+
+    def read(self, size=1):
+        data = self.mySerial.read(size)
+        self.capture.record(self.name, READ, data)
+        return data
+
+    def close(self):
+        self.mySerial.close()
+
+    # everything else, in_waiting and baudrate included, is the port's own
+    def __getattr__(self, name):
+        return getattr(self.mySerial, name)
+
+
+def readCapture(fileName):
+    """
+        Yields (time, kind, port name, data) for each record in a capture file.
+        A record cut short at the end of the file is dropped.
+    """
+    names = dict()
+    with open(fileName, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError(fileName + " is not a Lightsweeper capture file")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            (stamp, kind, port, length) = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            if kind == PORT:
+                names[port] = data.decode('utf-8')
+                continue
+            yield (stamp, kind, names.get(port, port), data)
+
+
+def replay(fileName, ports, speed=1.0):
+    """
+        Writes the recorded writes to the ports, given as a dict from captured
+        port name to pySerial object, at the recorded pace times speed, or as
+        fast as they will go if speed is None. Responses are read back as
+        they arrive, until the ports have gone quiet.
+        Returns a dict of bytes written, read, and recorded as read, and the
+        seconds the writes took to cross the wire.
+    """
+    stats = {"written": 0, "read": 0, "recorded": 0, "seconds": 0.0}
+    targets = set(ports.values())
+    # a write returns once the OS has the bytes, they are on the wire a byte time each later
+    wireFree = dict()
+    started = time.monotonic()
+    first = None
+    for (stamp, kind, port, data) in readCapture(fileName):
+        if port not in ports:
+            continue
+        if kind == READ:
+            stats["recorded"] += len(data)
+            continue
+        if first is None:
+            first = stamp
+        if speed is not None:
+            delay = started + (stamp - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        mySerial = ports[port]
+        mySerial.write(data)
+        # 10 bits on the wire per byte - start bit, 8 data bits, stop bit
+        wireFree[mySerial] = max(wireFree.get(mySerial, started), time.monotonic()) + len(data) / (mySerial.baudrate / 10)
+        stats["written"] += len(data)
+        stats["read"] += _drain(targets)
+    for mySerial in targets:
+        mySerial.flush()
+    finished = max(wireFree.values(), default=started)
+    stats["seconds"] = finished - started
+    # the last responses come back after the last bytes have arrived
+    delay = finished - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+    while True:
+        time.sleep(0.1)
+        count = _drain(targets)
+        if count == 0:
+            break
+        stats["read"] += count
+    return stats
+
+
+def _drain(ports):
+    count = 0
+    for mySerial in ports:
+        waiting = mySerial.in_waiting
+        if waiting > 0:
+            count += len(mySerial.read(waiting))
+    return count
+
+
+def capturedPorts(fileName):
+    """
+        Returns a dict of each captured port name to the set of tile addresses written to
+    """
+    ports = dict()
+    for (stamp, kind, port, data) in readCapture(fileName):
+        addresses = ports.setdefault(port, set())
+        if kind != WRITE:
+            continue
+        idx = 0
+        while idx < len(data):
+            if data[idx] & 0xF8:
+                addresses.add(data[idx] & 0xF8)
+            idx += (data[idx] & 0x07) + 2
+    return ports
+
+
+def main():
+    from docopt import docopt
+    import serial
+
+    args = docopt(__doc__)
+    fileName = args['<file>']
+
+    if args['dump']:
+        first = None
+        for (stamp, kind, port, data) in readCapture(fileName):
+            if first is None:
+                first = stamp
+            direction = "->" if kind == WRITE else "<-"
+            print("{:10.4f} {:s} {:s} {:s}".format(stamp - first, str(port), direction, ' '.join(format(x, '#02x') for x in data)))
+        return
+
+    captured = capturedPorts(fileName)
+    buses = []
+    ports = dict()
+    if args['-p'] is not None:
+        target = serial.Serial(args['-p'], 19200, timeout=0.01)
+        for port in captured:
+            ports[port] = target
+    else:
+        from LSVirtualBus import LSVirtualBus
+        for (port, addresses) in captured.items():
+            bus = LSVirtualBus(sorted(addresses))
+            buses.append(bus)
+            ports[port] = serial.Serial(bus.port, 19200, timeout=0.01)
+            print("Replaying " + str(port) + " to a simulated bus with tiles " + repr(sorted(addresses)))
+
+    speed = None if args['--fast'] else 1.0
+    stats = replay(fileName, ports, speed)
+    print("Wrote {:d} bytes in {:.3f} seconds ({:.0f} B/s), read {:d} bytes, {:d} were recorded".format(
+        stats["written"], stats["seconds"], stats["written"] / max(stats["seconds"], 1e-6), stats["read"], stats["recorded"]))
+    for bus in buses:
+        overruns = sum(bus.overruns().values())
+        if overruns > 0:
+            print("Simulated tiles on " + bus.port + " dropped " + str(overruns) + " bytes")
+
+    for mySerial in set(ports.values()):
+        mySerial.close()
+    for bus in buses:
+        bus.close()
+
+
+if __name__ == '__main__':
+
+    main()
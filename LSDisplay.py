@@ -1,97 +1,148 @@
-from LSRealFloor import LSRealFloor
-from LSEmulateFloor import EmulateFloor
 import Shapes
 import Colors
 import random
 import sys
 from Move import Move
-import pygame
+from LSFrameClock import wait
+from LSFrameBuffer import FrameBuffer
+from LSFrameBuffer import FloorSink
+from LSFrameBuffer import UNSET
+import numpy
 import time
 
 #handles animations as well as allowing a common controller for displaying
-#the state of the game on the real floor, on a simulated floor, on the console, or
-#any combination thereof
+#the state of the game on the real floor, on a simulated floor, on the console, on a
+#headless floor of NumPy arrays, or any combination thereof
+#each floor's module is only imported when it is used, so a headless display needs
+#neither pygame nor pyserial
+#games draw into a frame that heartbeat publishes, and each floor takes the latest
+#frame at its own pace - the real floor from its own thread, so a slow serial port
+#holds back neither the game nor the emulator
 class Display():
-    def __init__(self, row, cols, realFloor = False, simulatedFloor = False, console = False):
+    FRAME_GAP = 1 / 30
+
+    def __init__(self, row, cols, realFloor = False, simulatedFloor = False, console = False, headless = False):
         self.row = row
         self.cols = cols
         if realFloor:
             print("Display instantiating real floor")
+            from LSRealFloor import LSRealFloor
             self.realFloor = LSRealFloor(row, cols)
         else:
             self.realFloor = None
-        self.floor = []
-        for r in range(row):
-            self.floor.append([])
-            for c in range(cols):
-                self.floor[r].append('-')
         self.console = console
+        if console:
+            from LSDisplayConsole import ConsoleFloor
+            from LSDisplayConsole import ConsoleKeys
+            self.consoleFloor = ConsoleFloor(row, cols)
+            self.consoleKeys = ConsoleKeys()
+        else:
+            self.consoleFloor = None
+            self.consoleKeys = None
+        # tiles tapped from the keyboard, released on the next poll
+        self.tapped = []
         if simulatedFloor:
             print("Display instantiating simulated floor")
+            from LSEmulateFloor import EmulateFloor
             self.simulatedFloor = EmulateFloor(row, cols)
+        else:
+            self.simulatedFloor = None
+        if headless:
+            from LSHeadlessFloor import HeadlessFloor
+            self.headlessFloor = HeadlessFloor(row, cols)
+        else:
+            self.headlessFloor = None
+        # games write shapes and colors here as often as they like, heartbeat publishes them
+        self.shapes = numpy.full((row, cols), UNSET, dtype=numpy.int16)
+        self.colors = numpy.full((row, cols), UNSET, dtype=numpy.int16)
+        self.changed = False
+        self.frames = FrameBuffer(row, cols)
+        self.sinks = []
+        if self.realFloor:
+            self.sinks.append(FloorSink("real floor", self.realFloor, self.frames, self.FRAME_GAP))
+        if self.simulatedFloor:
+            # pygame draws from the game thread
+            self.sinks.append(FloorSink("simulated floor", self.simulatedFloor, self.frames, threaded=False))
+        if self.headlessFloor:
+            # kept in step with the game so tests can check it after each heartbeat
+            self.sinks.append(FloorSink("headless floor", self.headlessFloor, self.frames, threaded=False))
+        if self.consoleFloor:
+            self.sinks.append(FloorSink("console", self.consoleFloor, self.frames, threaded=False))
 
 
 
     #this is to handle display functions only
     def heartbeat(self):
         #print("Display heartbeat")
-        if self.simulatedFloor:
-            self.simulatedFloor.heartbeat()
-        if self.realFloor:
-            self.realFloor.heartbeat()
+        if self.changed:
+            self.frames.publish(self.shapes, self.colors)
+            self.changed = False
+        for sink in self.sinks:
+            if not sink.threaded:
+                sink.pump()
         #check pygame for position and click ness of mouse
         pass
 
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+        if self.realFloor:
+            self.realFloor.close()
+        if self.consoleFloor:
+            self.consoleFloor.close()
+            self.consoleKeys.close()
+
     def printFloor(self):
-        print("printing floor")
-        s = ''
-        for r in range(self.row):
-            for c in range(self.col):
-                s += ' ' + str(self.floor[r][c])
-            print(s)
-            s = ''
+        self.consoleFloor.heartbeat()
+        self.consoleFloor.park()
 
+    #steps from every floor and the keyboard, none of which wait for input
     def pollSensors(self):
         sensorsChanged = []
-        if self.realFloor:
-            sensorsChanged = self.realFloor.pollSensors()
-        if self.console and not self.realFloor:
-            self.printFloor()
-            consoleIn = input("Type in the next move")
-            consoleIn = consoleIn.split(',')
-            move = Move(int(consoleIn[0]), int(consoleIn[1]), 0)
-            sensorsChanged.append(move)
-        #we want to ensure we never return a NoneType
-        if sensorsChanged is None:
-            return []
+        for floor in (self.realFloor, self.simulatedFloor, self.headlessFloor):
+            if floor:
+                moves = floor.pollSensors()
+                #we want to ensure we never return a NoneType
+                if moves is not None:
+                    sensorsChanged.extend(moves)
+        if self.consoleKeys:
+            sensorsChanged.extend(self.pollKeys())
         return sensorsChanged
 
+    #each key typed steps on and off the tile labelled with it
+    def pollKeys(self):
+        moves = [Move(row, col, 0, False) for (row, col) in self.tapped]
+        self.tapped = []
+        keymap = self.consoleFloor.keymap
+        for key in self.consoleKeys.read():
+            n = keymap.find(key)
+            if n < 0 or n >= self.row * self.cols:
+                continue
+            (row, col) = (n // self.cols, n % self.cols)
+            moves.append(Move(row, col, 0, True))
+            self.tapped.append((row, col))
+        return moves
+
+    #tiles where a step matters to the game, the real floor polls them every frame
+    def setLiveTiles(self, cells):
+        if self.realFloor:
+            self.realFloor.setLiveTiles(cells)
+
     def set(self, row, col, shape, color):
         #print("set:", row, col, shape, color)
         #if shape is not 126:
         #    print("set", row, col, bin(shape))
-        if self.console:
-            self.floor[row][col] = Shapes.hexToDigit(shape)
-        if self.realFloor:
-            self.realFloor.set(row, col, shape, color)
-        if self.simulatedFloor:
-            self.simulatedFloor.setColor(row, col, color)
-            self.simulatedFloor.setShape(row, col, shape)
-        wait(0.005)
+        self.shapes[row, col] = shape
+        self.colors[row, col] = color
+        self.changed = True
 
     def setColor(self, row, col, color):
-        if self.realFloor:
-            self.realFloor.setColor(row, col, color)
-        if self.simulatedFloor:
-            self.simulatedFloor.setColor(row, col, color)
-        wait(0.005)
+        self.colors[row, col] = color
+        self.changed = True
 
     def setShape(self, row, col, shape):
-        if self.realFloor:
-            self.realFloor.setShape(row, col, shape)
-        if self.simulatedFloor:
-            self.simulatedFloor.setShape(row, col, shape)
-        wait(0.005)
+        self.shapes[row, col] = shape
+        self.changed = True
 
     def setFrame(self, frame):
         for row in range(self.row):
@@ -117,12 +168,6 @@ class Display():
     def clear(self):
         pass
 
-def wait(seconds):
-    # self.pollSensors()
-    currentTime = time.time()
-    while time.time() - currentTime < seconds:
-        pass
-
 def main():
     print("Testing LSDisplay realfloor and emulatedfloor")
     display = Display(3, 8, True, True, False)
@@ -130,18 +175,22 @@ def main():
     for j in range(8):
         display.setColor(0, j, Colors.RED)
         display.setShape(0, j, Shapes.ZERO)
+    display.heartbeat()
     wait(0.2)
     for j in range(8):
         display.setColor(1, j, Colors.YELLOW)
         display.setShape(1, j, Shapes.ZERO)
+    display.heartbeat()
     wait(0.2)
     for j in range(8):
         display.setColor(2, j, Colors.GREEN)
         display.setShape(2, j, Shapes.ZERO)
+    display.heartbeat()
     wait(0.2)
     for i in range(3):
         for j in range(8):
             display.setShape(i, j, Shapes.digitToHex(i))
+            display.heartbeat()
             wait(0.01)
     wait(0.2)
     for i in range(0, 100):
@@ -2,17 +2,33 @@
 import Shapes
 #from LSEmulateFloor import LSEmulateFloor
 import sys
+import os
+import select
 import string
+import atexit
 import Move
 
+try:
+    import termios
+    import tty
+except ImportError:
+    termios = None
+
 ClearScreen = "\x1b[37;40m" #"\x1b[2J"
 SetColorFg = "\x1b[3%s;40m"
 SetColorBg = "\x1b[4%s;30m"
+EraseScreen = "\x1b[2J"
+EraseBelow = "\x1b[J"
+MoveCursor = "\x1b[%d;%dH"
+HideCursor = "\x1b[?25l"
+ShowCursor = "\x1b[?25h"
+ResetAttributes = "\x1b[0m"
 """
-  0 
-1   5
+shapes are -abcdefg, S is the bits a to g
+  0
+5   1
   6
-2   4
+4   2
   3
 """
 
@@ -31,15 +47,135 @@ def vbar(s):
 def getLinesForShape(shape):
     L = [ "", "", "", "", "" ]
     
-    S = bin(shape)[2:]
+    S = format(shape & 0x7F, "07b")
     L[0] += " %s " % (hbar(S[0]))
-    L[1] += "%s  %s" % (vbar(S[1]), vbar(S[5]))
+    L[1] += "%s  %s" % (vbar(S[5]), vbar(S[1]))
     L[2] += " %s " % (hbar(S[6]))
-    L[3] += "%s  %s" % (vbar(S[2]), vbar(S[4]))
+    L[3] += "%s  %s" % (vbar(S[4]), vbar(S[2]))
     L[4] += " %s " % (hbar(S[3]))
 
     return L
 
+#draws the floor on an ANSI terminal, rewriting only the tiles that changed
+#each tile is a 5x5 block of characters, labelled with the key that steps on it
+class ConsoleFloor():
+    GLYPH_ROWS = 5
+    GLYPH_COLS = 5
+
+    def __init__(self, rows, cols, out = None, keymap = None):
+        self.rows = rows
+        self.cols = cols
+        self.out = sys.stdout if out is None else out
+        self.keymap = string.ascii_lowercase + string.ascii_uppercase if keymap is None else keymap
+        # (shape, color, pressed) -> the lines of the tile, colored
+        self.glyphs = dict()
+        self.tiles = [[[0, 0, False] for c in range(cols)] for r in range(rows)]
+        self.shown = [[None for c in range(cols)] for r in range(rows)]
+        self.dirty = set()
+        self.cleared = False
+
+    def set(self, row, col, shape, color):
+        self.tiles[row][col][0] = shape
+        self.tiles[row][col][1] = color
+        self.dirty.add((row, col))
+
+    def setColor(self, row, col, color):
+        self.tiles[row][col][1] = color
+        self.dirty.add((row, col))
+
+    def setShape(self, row, col, shape):
+        self.tiles[row][col][0] = shape
+        self.dirty.add((row, col))
+
+    def press(self, row, col, pressed = True):
+        self.tiles[row][col][2] = pressed
+        self.dirty.add((row, col))
+
+    def key(self, row, col):
+        k = row * self.cols + col
+        return self.keymap[k] if k < len(self.keymap) else " "
+
+    def glyph(self, shape, color, pressed):
+        glyph = self.glyphs.get((shape, color, pressed))
+        if glyph is None:
+            colorcode = (SetColorBg if pressed else SetColorFg) % color
+            # the color carries over from line to line, so only the first sets it
+            glyph = [" " + line for line in getLinesForShape(shape)]
+            glyph[0] = colorcode + glyph[0]
+            self.glyphs[(shape, color, pressed)] = glyph
+        return glyph
+
+    #writes the tiles that changed since the last heartbeat in one write
+    def heartbeat(self):
+        if self.cleared and len(self.dirty) == 0:
+            return
+        out = []
+        if not self.cleared:
+            out.append(HideCursor + ResetAttributes + EraseScreen)
+            self.dirty = set((r, c) for r in range(self.rows) for c in range(self.cols))
+            self.cleared = True
+        for (row, col) in sorted(self.dirty):
+            (shape, color, pressed) = self.tiles[row][col]
+            if self.shown[row][col] == (shape, color, pressed):
+                continue
+            y = row * self.GLYPH_ROWS + 1
+            x = col * self.GLYPH_COLS + 1
+            for (i, line) in enumerate(self.glyph(shape, color, pressed)):
+                out.append(MoveCursor % (y + i, x) + line)
+            # the label takes the first character of the top line, in the tile's color
+            out.append(MoveCursor % (y, x + 1) + self.key(row, col))
+            self.shown[row][col] = (shape, color, pressed)
+        self.dirty.clear()
+        if len(out) == 0:
+            return
+        # leave the cursor under the floor for anything else printed
+        out.append(ResetAttributes + MoveCursor % (self.rows * self.GLYPH_ROWS + 1, 1))
+        self.out.write("".join(out))
+        self.out.flush()
+
+    #puts the cursor back under the floor and clears what was typed there
+    def park(self):
+        self.out.write(ResetAttributes + MoveCursor % (self.rows * self.GLYPH_ROWS + 1, 1) + EraseBelow)
+        self.out.flush()
+
+    #draws every tile again, after something else has written over the floor
+    def redraw(self):
+        self.cleared = False
+        self.shown = [[None for c in range(self.cols)] for r in range(self.rows)]
+
+    def close(self):
+        self.out.write(ResetAttributes + ShowCursor + "\n")
+        self.out.flush()
+
+#keys typed at the terminal, read without waiting for Enter and without blocking
+#the terminal is put in cbreak mode while this is open, so keys are not echoed
+class ConsoleKeys():
+    def __init__(self, stream = None):
+        self.stream = sys.stdin if stream is None else stream
+        self.fd = self.stream.fileno()
+        self.saved = None
+        if termios is not None and os.isatty(self.fd):
+            self.saved = termios.tcgetattr(self.fd)
+            tty.setcbreak(self.fd)
+            # put the terminal back even if the game never calls close
+            atexit.register(self.close)
+
+    #returns the keys typed since the last read, or "" if there are none
+    def read(self):
+        keys = ""
+        while len(select.select([self.fd], [], [], 0)[0]) > 0:
+            data = os.read(self.fd, 1024)
+            if len(data) == 0:
+                # end of input, nothing more will come
+                break
+            keys += data.decode("utf-8", "replace")
+        return keys
+
+    def close(self):
+        if self.saved is not None:
+            termios.tcsetattr(self.fd, termios.TCSADRAIN, self.saved)
+            self.saved = None
+
 #handles animations as well as allowing a common controller for displaying
 #the state of the game on the real floor, on a simulated floor, on the console, or
 #any combination thereof
@@ -47,9 +183,11 @@ class Display():
     def __init__(self, rows, cols, realFloor = False, simulator = False, console = False):
         self.row = rows
         self.col = cols
-        self.floor = [ [[]] * cols ] * rows
+        self.floor = [ [[0, 0] for c in range(cols)] for r in range(rows) ]
         self.keymap = string.ascii_lowercase + string.ascii_uppercase
         self.depressed = ""
+        self.console = ConsoleFloor(rows, cols, keymap = self.keymap)
+        self.keys = ConsoleKeys()
 
     #this is to handle display functions only
     def heartbeat(self):
@@ -59,43 +197,37 @@ class Display():
         print("setting up Qt timer event based loop")
 
     def printFloor(self):
-        k=0
-        print(ClearScreen)
         for r in range(self.row):
-            lines = [ "", "", "", "", "" ]
             for c in range(self.col):
                 shape, color = self.floor[r][c]
-                L = getLinesForShape(shape)
-                key = self.keymap[k]
-                k += 1
-                if key in self.depressed:
-                    colorcode = SetColorBg % color
-                else:
-                    colorcode = SetColorFg % color
-                L[0] = key + L[0][1:]
-                for i in range(len(L)):
-                    lines[i] += colorcode + " " + L[i]
-            print("\n".join(lines))
+                self.console.set(r, c, shape, color)
+                self.console.press(r, c, self.console.key(r, c) in self.depressed)
+        self.console.heartbeat()
+        self.console.park()
 
     def pollSensors(self):
         sensorsChanged = []
         self.printFloor()
-        for x in input(""):
+        for x in self.keys.read():
+            if x.isspace():
+                continue
             if x not in self.keymap:
                 print ("invalid move '%s', ignoring" % x)
+                self.console.redraw()
                 continue
 
             if x in self.depressed:
                 i = self.depressed.index(x)
                 self.depressed = self.depressed[:i] + self.depressed[i+1:]
-                print(self.depressed)
+                pressed = False
             else:
                 self.depressed += x
+                pressed = True
 
             n = self.keymap.index(x)
-            r = int(n / self.row)
-            c = int(n % self.row)
-            move = Move.Move(r,c,0)
+            r = int(n / self.col)
+            c = int(n % self.col)
+            move = Move.Move(r,c,0,pressed)
             sensorsChanged.append(move) #we want to ensure we never return a NoneType
 
         return sensorsChanged
@@ -121,6 +253,9 @@ class Display():
     def setSegmentsCustom(self, row, col, colors):
         pass
 
+    def setLiveTiles(self, cells):
+        pass
+
     def add(self, row, col, shape, color):
         pass
 
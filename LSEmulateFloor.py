@@ -7,30 +7,45 @@ import Colors
 import pygame
 
 class EmulateFloor(LSApi):
+    TILE_SIZE = 100
 
     def __init__(self, rows, cols):
         print("Making the screen")
         self.screen = pygame.display.set_mode((800, 800))
+        self.screen.fill(Colors.BLACK)
         self.rows = rows
         self.cols = cols
+        # tiles changed since the last heartbeat
+        self.dirty = set()
+        # the tile the mouse button went down on, released with the button
+        self.clicked = None
         self.tiles = []
         for r in range(0,rows):
             self.tiles.append([])
             for c in range(0, cols):
                 self.tiles[r].append(EmulateTile(self, r, c))
+                self.dirty.add((r, c))
+
+    def _markDirty(self, row, col):
+        self.dirty.add((row, col))
 
     def heartbeat(self):
-        #gets the images from the individual tiles, blits them in succession
-        #print("heartbeat drawing floor")
-        background = pygame.Surface((800, 800))
-        background.fill(Colors.BLACK)
-        self.screen.blit(background, (0,0))
-        for r in range(0, self.rows):
-            for c in range(0, self.cols):
-                tile = self.tiles[r][c]
-                image = tile.loadImage()
-                self.screen.blit(image, (100 * r, 100 * c))
-        pygame.display.update()
+        #redraws only the tiles that changed and updates just those parts of the screen
+        if len(self.dirty) == 0:
+            return
+        rects = []
+        for (r, c) in self.dirty:
+            image = self.tiles[r][c].loadImage()
+            # each tile draws only in its own cell of the grid, so a glyph wider than
+            # the cell, like the test.bmp fallback, cannot spill onto its neighbours
+            cell = pygame.Rect(self.TILE_SIZE * r, self.TILE_SIZE * c, self.TILE_SIZE, self.TILE_SIZE)
+            self.screen.set_clip(cell)
+            self.screen.fill(Colors.BLACK, cell)
+            self.screen.blit(image, cell.topleft)
+            rects.append(cell)
+        self.screen.set_clip(None)
+        self.dirty.clear()
+        pygame.display.update(rects)
 
     def _flushQueue(self):
         pass
@@ -67,12 +82,41 @@ class EmulateFloor(LSApi):
     def _getRows (self):
         return self.rows
 
+    #a click steps on the tile under the mouse until the button comes up
     def pollSensors(self):
-        pass
+        moves = []
+        others = []
+        for event in pygame.event.get():
+            if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                self.clicked = self._tileAt(event.pos)
+                if self.clicked is not None:
+                    moves.append(Move(self.clicked[0], self.clicked[1], 0, True))
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                if self.clicked is not None:
+                    moves.append(Move(self.clicked[0], self.clicked[1], 0, False))
+                    self.clicked = None
+            elif event.type >= pygame.USEREVENT:
+                # not ours, Audio waits for its song end events
+                others.append(event)
+        for event in others:
+            pygame.event.post(event)
+        return moves
+
+    def _tileAt(self, pos):
+        # tiles are laid out with rows across the screen and columns down it
+        (row, col) = (pos[0] // self.TILE_SIZE, pos[1] // self.TILE_SIZE)
+        if row < self.rows and col < self.cols:
+            return (row, col)
+        return None
 
     def handleTileSensed(self, row, col):
         pass
 
+    def set(self, row, col, shape, color):
+        tile = self.tiles[row][col]
+        tile.setColor(color)
+        tile.setShape(shape)
+
     def setColor(self, row, column, color, setItNow = True):
         #tileList = self._getTileList(row, column)
         #for tile in tileList:
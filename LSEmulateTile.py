@@ -5,6 +5,44 @@ import Shapes
 import pygame
 from LSEmulateSevenSegment import LSEmulateSevenSegment
 
+# decodes each shape image once and keeps a tinted copy per shape and color
+# shared by every emulated tile, so drawing a tile is a dictionary lookup and a blit
+class GlyphAtlas():
+    SHAPE_FILES = {
+        Shapes.ZERO: "img_zero.png",
+        Shapes.ONE: "img_one.png",
+        Shapes.TWO: "img_two.png",
+        Shapes.THREE: "img_three.png",
+        Shapes.FOUR: "img_four.png",
+        Shapes.FIVE: "img_five.png",
+        Shapes.SIX: "img_six.png",
+        Shapes.SEVEN: "img_seven.png",
+        Shapes.EIGHT: "img_eight.png",
+        Shapes.NINE: "img_nine.png",
+    }
+    DEFAULT_FILE = "test.bmp"
+
+    def __init__(self):
+        self.images = dict()    # file name -> decoded image
+        self.glyphs = dict()    # (shape, color) -> tinted image
+
+    def glyph(self, shape, color):
+        """
+            Returns the image of shape in color, to be blitted and not changed
+        """
+        key = (shape, color)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            fileName = self.SHAPE_FILES.get(shape, self.DEFAULT_FILE)
+            if fileName not in self.images:
+                self.images[fileName] = pygame.image.load(fileName).convert_alpha()
+            glyph = self.images[fileName].copy()
+            glyph.fill(Colors.intToRGB(color), special_flags=pygame.BLEND_RGBA_MULT)
+            self.glyphs[key] = glyph
+        return glyph
+
+atlas = GlyphAtlas()
+
 # this class holds a seven segment display and a button to mimic the pressure sensor
 # it does no segment processing, it just passes thru to the seven segment display
 class EmulateTile(LSApi):
@@ -21,6 +59,8 @@ class EmulateTile(LSApi):
 
     def setColor (self, newColor, setItNow = True):
         #change the state.
+        if newColor != self.color:
+            self.floor._markDirty(self.row, self.col)
         self.color = newColor
         if not setItNow:
             print("[LSEmulateTile] Non-instantaneous setting not yet supported.")
@@ -29,36 +69,15 @@ class EmulateTile(LSApi):
         return self.color
 
     def setShape(self, shape, setItNow = True):
+        if shape != self.shape:
+            self.floor._markDirty(self.row, self.col)
         self.shape = shape
 
     def getShape(self):
         return self.shape
 
     def loadImage(self):
-        fileName = "test.bmp"
-        if self.getShape() is Shapes.ZERO:
-            fileName = "img_zero.png"
-        if self.getShape() is Shapes.ONE:
-            fileName = "img_one.png"
-        if self.getShape() is Shapes.TWO:
-            fileName = "img_two.png"
-        if self.getShape() is Shapes.THREE:
-            fileName = "img_three.png"
-        if self.getShape() is Shapes.FOUR:
-            fileName = "img_four.png"
-        if self.getShape() is Shapes.FIVE:
-            fileName = "img_five.png"
-        if self.getShape() is Shapes.SIX:
-            fileName = "img_six.png"
-        if self.getShape() is Shapes.SEVEN:
-            fileName = "img_seven.png"
-        if self.getShape() is Shapes.EIGHT:
-            fileName = "img_eight.png"
-        if self.getShape() is Shapes.NINE:
-            fileName = "img_nine.png"
-        image = pygame.image.load(fileName).convert_alpha()
-        image.fill(Colors.intToRGB(self.getColor()), special_flags=pygame.BLEND_RGBA_MULT)
-        return image
+        return atlas.glyph(self.getShape(), self.getColor())
 
     # set immediately or queue these segments in addressed tiles
     # segments is a seven-tuple interpreted as True or False
@@ -116,6 +116,52 @@ class lsFloorConfig:
             return True
 
 
+    def calibrationFileName(self):
+        """
+            The sensor calibration cache kept next to the config file
+        """
+        if self.fileName is None:
+            return None
+        return os.path.splitext(self.fileName)[0] + ".calibration"
+
+    def loadCalibration(self):
+        """
+            This function loads the cached per tile sensor calibration for this floor
+
+            Returns:
+                A dictionary mapping (port, address) to (adcMin, adcMax, threshold),
+                empty if there is no cache or it can not be parsed. Entries saved
+                without a threshold get the midpoint.
+        """
+        calFile = self.calibrationFileName()
+        if calFile is None or os.path.isfile(calFile) is not True:
+            return dict()
+        try:
+            with open(calFile) as f:
+                calibration = dict()
+                for entry in json.load(f):
+                    (port, addr, adcMin, adcMax) = entry[:4]
+                    threshold = entry[4] if len(entry) > 4 else (adcMin + adcMax) // 2
+                    calibration[(port, addr)] = (adcMin, adcMax, threshold)
+                return calibration
+        except Exception as e:
+            print(e)
+            print("Ignoring unreadable calibration cache " + calFile)
+            return dict()
+
+    def writeCalibration(self, calibration):
+        """
+            This function saves per tile sensor calibration, a dictionary mapping
+            (port, address) to (adcMin, adcMax, threshold), as a list of 5-tuples
+        """
+        calFile = self.calibrationFileName()
+        if calFile is None:
+            raise IOError("fileName must be set to save a calibration.")
+        cal = [(port, addr) + tuple(values) for ((port, addr), values) in sorted(calibration.items())]
+        with open(calFile, 'w') as f:
+            json.dump(cal, f, indent = 4)
+
+
     # prints the list of 4-tuples
     def printConfig(self):
         """
@@ -318,7 +364,8 @@ def main():
         else:
             print("Configuring {:s}...".format(config.fileName))
 
-        tilepile = lsOpen()
+        # scan every port, the saved map would hide tiles added since it was saved
+        tilepile = lsOpen(useCache=False)
 
         # serial ports are COM<N> on windows, /dev/xyzzy on Unixlike systems
         availPorts = list(tilepile.lsMatrix)
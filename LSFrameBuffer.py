@@ -0,0 +1,116 @@
+### The latest frame of the floor, shared by the game and the floor backends
+import threading
+
+import numpy
+
+from LSFrameClock import FrameClock
+
+# shape or color that has not been set yet
+UNSET = -1
+
+
+class FrameBuffer():
+    """
+        Holds the most recently published frame as shape and color arrays.
+        Publishing replaces the frame, so a reader that falls behind skips
+        straight to the newest one. Published arrays are never changed
+        afterwards and can be read without copying.
+    """
+
+    def __init__(self, rows, cols):
+        self.shapes = numpy.full((rows, cols), UNSET, dtype=numpy.int16)
+        self.colors = numpy.full((rows, cols), UNSET, dtype=numpy.int16)
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def publish(self, shapes, colors):
+        shapes = shapes.copy()
+        colors = colors.copy()
+        with self.lock:
+            self.shapes = shapes
+            self.colors = colors
+            self.version += 1
+
+    def latest(self, version=0):
+        """
+            Returns (version, shapes, colors) if there is a frame newer than
+            version, else None
+        """
+        with self.lock:
+            if self.version <= version:
+                return None
+            return (self.version, self.shapes, self.colors)
+
+
+class FloorSink():
+    """
+        Sends frames from a FrameBuffer to one floor backend, only the tiles
+        that changed since the last frame it sent.
+
+        A threaded sink runs in its own thread at its own frame rate, so a
+        slow floor never holds back the game or the other floors, and frames
+        published while it was busy are dropped. Otherwise the game loop
+        calls pump(), for backends like pygame that have to stay on the
+        main thread.
+    """
+
+    def __init__(self, name, floor, frames, frameGap=1/30, threaded=True):
+        self.name = name
+        self.floor = floor
+        self.frames = frames
+        self.frameGap = frameGap
+        self.threaded = threaded
+        (rows, cols) = frames.shapes.shape
+        self.shapes = numpy.full((rows, cols), UNSET, dtype=numpy.int16)
+        self.colors = numpy.full((rows, cols), UNSET, dtype=numpy.int16)
+        self.version = 0
+        self.sent = 0       # frames sent to the floor
+        self.dropped = 0    # frames replaced before the floor took them
+        self.stopping = threading.Event()
+        self.thread = None
+        if threaded:
+            self.thread = threading.Thread(target=self._run, name="FloorSink " + str(name))
+            self.thread.daemon = True
+            self.thread.start()
+
+    def pump(self):
+        """
+            Sends the newest frame if there is one, then runs the floor's heartbeat.
+            Returns True if a frame was sent.
+        """
+        frame = self.frames.latest(self.version)
+        if frame is not None:
+            self._send(frame)
+        self.floor.heartbeat()
+        return frame is not None
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _run(self):
+        clock = FrameClock(self.frameGap)
+        while not self.stopping.is_set():
+            self.pump()
+            clock.tick()
+
+    def _send(self, frame):
+        (version, shapes, colors) = frame
+        self.dropped += version - self.version - 1
+        for (row, col) in numpy.argwhere((shapes != self.shapes) | (colors != self.colors)):
+            (row, col) = (int(row), int(col))
+            shape = int(shapes[row, col])
+            color = int(colors[row, col])
+            newShape = shape != UNSET and shape != self.shapes[row, col]
+            newColor = color != UNSET and color != self.colors[row, col]
+            if newShape and newColor:
+                self.floor.set(row, col, shape, color)
+            elif newColor:
+                self.floor.setColor(row, col, color)
+            elif newShape:
+                self.floor.setShape(row, col, shape)
+        self.shapes = shapes
+        self.colors = colors
+        self.version = version
+        self.sent += 1
@@ -0,0 +1,58 @@
+### Sleep based frame timing shared by the game engine and the display
+import time
+
+class FrameClock():
+    """
+        Hands out frame deadlines on the monotonic clock and sleeps until
+        each one, instead of spinning on time.time().
+
+        Deadlines advance by exactly frameGap so sleep jitter does not add up
+        over time. A frame that starts late runs immediately and the clock
+        catches back up on the following frames. If the loop falls more than
+        maxCatchUp frames behind, the missed frames are skipped and the next
+        deadline is the first one still ahead on the original schedule, so
+        the phase is kept. reset() restarts the schedule from now.
+    """
+
+    def __init__(self, frameGap, maxCatchUp=3):
+        self.frameGap = frameGap
+        self.maxCatchUp = maxCatchUp
+        self.deadline = time.monotonic() + frameGap
+        self.frames = 0
+        self.skipped = 0
+
+    def tick(self):
+        """
+            Sleeps until the next frame is due.
+            Returns the number of frames that were skipped to get back on schedule.
+        """
+        now = time.monotonic()
+        skipped = 0
+        if now < self.deadline:
+            time.sleep(self.deadline - now)
+            self.deadline += self.frameGap
+        else:
+            behind = int((now - self.deadline) / self.frameGap)
+            if behind > self.maxCatchUp:
+                # too far behind to catch up, drop those frames and keep the phase
+                skipped = behind
+                self.deadline += (behind + 1) * self.frameGap
+            else:
+                self.deadline += self.frameGap
+        self.frames += 1
+        self.skipped += skipped
+        return skipped
+
+    def reset(self):
+        """
+            Restarts the schedule with the next frame one frameGap from now
+        """
+        self.deadline = time.monotonic() + self.frameGap
+
+
+def wait(seconds):
+    """
+        Sleeps for the given number of seconds without burning a core
+    """
+    if seconds > 0:
+        time.sleep(seconds)
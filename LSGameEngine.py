@@ -1,8 +1,37 @@
-import time
 from minesweeper import Minesweeper
 from EightbitSoundboard import Soundboard
 from LSDisplay import Display
-from LSAudio import Audio
+from LSFrameClock import FrameClock
+from LSFrameClock import wait
+
+#stands in for Audio when the engine runs headless, without pygame
+class SilentAudio():
+    def heartbeat(self):
+        pass
+
+    def loadSong(self, filename, name):
+        pass
+
+    def playSong(self, filename, loops=0):
+        pass
+
+    def stopSong(self, fadeOut = 0.1):
+        pass
+
+    def setSongVolume(self, vol):
+        pass
+
+    def shuffleSongs(self):
+        pass
+
+    def playSound(self, filename):
+        pass
+
+    def stopSounds(self):
+        pass
+
+    def setSoundVolume(self, vol):
+        pass
 
 #enforces the framerate, pushes sensor data to games, and selects games
 class GameEngine():
@@ -10,12 +39,20 @@ class GameEngine():
     REAL_FLOOR = True
     SIMULATED_FLOOR = True
     CONSOLE = False
+    HEADLESS = False
     ROWS = 3
     COLUMNS = 8
 
+    #HEADLESS runs the games on the headless floor alone, with no sound, so it needs
+    #neither pygame nor pyserial
     def __init__(self):
-        self.display = Display(self.ROWS, self.COLUMNS, self.REAL_FLOOR, self.SIMULATED_FLOOR, self.CONSOLE)
-        self.audio = Audio()
+        if self.HEADLESS:
+            self.display = Display(self.ROWS, self.COLUMNS, headless = True)
+            self.audio = SilentAudio()
+        else:
+            from LSAudio import Audio
+            self.display = Display(self.ROWS, self.COLUMNS, self.REAL_FLOOR, self.SIMULATED_FLOOR, self.CONSOLE)
+            self.audio = Audio()
         self.newGame()
 
     def newGame(self):
@@ -23,9 +60,10 @@ class GameEngine():
         #self.game = Soundboard(self.display, self.audio, self.ROWS, self.COLUMNS)
 
     def beginLoop(self):
+        clock = FrameClock(self.FRAME_GAP)
         #while True:
         for i in range(0, 100):
-            self.wait(self.FRAME_GAP)
+            clock.tick()
             self.enterFrame()
 
     def beginEmulatorLoop(self):
@@ -41,10 +79,7 @@ class GameEngine():
             self.newGame()
 
     def wait(self, seconds):
-        # self.pollSensors()
-        currentTime = time.time()
-        while time.time() - currentTime < seconds:
-            pass
+        wait(seconds)
 
     def pollSensors(self):
         sensorsChanged = self.display.pollSensors()
@@ -0,0 +1,81 @@
+### A floor with no window and no serial port, kept as NumPy arrays
+import numpy
+
+import Colors
+from Move import Move
+
+# bit of each segment, a to g, in the -abcdefg shape byte
+SEGMENT_BITS = numpy.array([0x40 >> i for i in range(7)], dtype=numpy.uint8)
+
+# RGB of each color number, the same as the emulator shows
+COLOR_RGB = numpy.array([Colors.intToRGB(i) for i in range(8)], dtype=numpy.uint8)
+
+
+class HeadlessFloor():
+    """
+        Floor backend for tests and benchmarks. It takes the same calls as
+        LSRealFloor and EmulateFloor but only keeps state:
+
+            shapes      rows x cols, the -abcdefg segment byte of each tile
+            colors      rows x cols, the color number of each tile
+            segments    rows x cols x 7 x 3, the RGB of every segment
+
+        segments is brought up to date by heartbeat. Steps are injected with
+        step() and come back from pollSensors() like sensor reads.
+    """
+
+    def __init__(self, rows, cols):
+        self.rows = rows
+        self.cols = cols
+        self.shapes = numpy.zeros((rows, cols), dtype=numpy.uint8)
+        self.colors = numpy.zeros((rows, cols), dtype=numpy.uint8)
+        self.segments = numpy.zeros((rows, cols, 7, 3), dtype=numpy.uint8)
+        self.changed = False
+        self.frames = 0
+        self.moves = []
+
+    def set(self, row, col, shape, color):
+        self.shapes[row, col] = shape
+        self.colors[row, col] = color
+        self.changed = True
+
+    def setColor(self, row, col, color):
+        self.colors[row, col] = color
+        self.changed = True
+
+    def setShape(self, row, col, shape):
+        self.shapes[row, col] = shape
+        self.changed = True
+
+    def setAllColor(self, color):
+        self.colors[:, :] = color
+        self.changed = True
+
+    def setAllShape(self, shape):
+        self.shapes[:, :] = shape
+        self.changed = True
+
+    def heartbeat(self):
+        self.frames += 1
+        if not self.changed:
+            return
+        lit = (self.shapes[:, :, None] & SEGMENT_BITS) != 0
+        self.segments = lit[:, :, :, None] * COLOR_RGB[self.colors % len(COLOR_RGB)][:, :, None, :]
+        self.changed = False
+
+    def step(self, row, col, pressed=True, val=0):
+        """
+            Queues a press or release of a tile for the next pollSensors
+        """
+        self.moves.append(Move(row, col, val, pressed))
+
+    def pollSensors(self):
+        moves = self.moves
+        self.moves = []
+        return moves
+
+    def setLiveTiles(self, cells):
+        pass
+
+    def close(self):
+        pass
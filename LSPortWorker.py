@@ -0,0 +1,506 @@
+### Background I/O for one Lightsweeper serial port
+
+import queue
+import threading
+import time
+from collections import deque
+from collections import OrderedDict
+
+import serial
+
+from LSTelemetry import PortTelemetry
+
+# from ls_wireAPI.h - a tile with debug output on logs CMD_DONE for every command
+# it accepts and then echoes its mode byte
+LS_DEBUG = 0x17
+CMD_DONE = 0xCC
+
+# from ls_wireAPI.h - display commands that a later one of the same kind for the
+# same tile replaces, segment commands are 0x80 to 0xBF
+LS_LATCH = 0x10
+SET_COLOR = 0x20
+SET_SHAPE = 0x21
+SET_TRANSITION = 0x22
+SEGMENT_CMD = 0x80
+SEGMENT_CMD_END = 0xBF
+SEGMENT_FIELDS = (0x20, 0x08, 0x10)
+SEGMENT_KEEP_MASK = 0x80
+CONDX_MASK = 0x06
+CONDX_LATCH = 0x02
+
+# a command waiting to be sent by a port worker, with room for the tile's response
+class LSPortRequest():
+    # longest wait() gives the worker to get to a request, behind whatever was queued first
+    QUEUE_TIMEOUT = 1.0
+
+    def __init__(self, data, count=0, timeout=None):
+        self.data = bytes(data)
+        self.count = count      # number of response bytes to read back, 0 for none
+        self.timeout = timeout  # how long past replyBy wait() blocks by default, None for no limit
+        self.response = None
+        self.replyBy = None     # when the reply should be in, set by the worker as it sends
+        self.queued = time.monotonic()
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+            Blocks until the port worker has serviced this request and
+            returns the bytes read back (None for plain writes). The timeout
+            runs from when the reply was due, so the work queued on the port
+            ahead of it does not count. If the reply has not come by then,
+            or the worker has not got to the request within QUEUE_TIMEOUT,
+            returns None as for a missed read.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is None:
+            self.done.wait()
+            return self.response
+        while not self.done.is_set():
+            if self.replyBy is None:
+                deadline = self.queued + self.QUEUE_TIMEOUT
+            else:
+                deadline = self.replyBy + timeout
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # the worker may send it, or send it again, while waiting
+            self.done.wait(min(remaining, timeout))
+        return self.response
+
+
+class LSPortPacer():
+    """
+        Keeps writes to one port within what the tiles can take.
+
+        Every tile on a port gets every byte into its receive buffer, and
+        takes one command out of it per pass of its loop, whoever the
+        command is for. So a port carries at most one command per loop time,
+        however fast the wire is. The pacer models that buffer: when each
+        command has arrived at the wire rate, and when a loop pass takes it
+        out. A write is held back until its command fits in the buffer.
+
+        A write can reach the wire later than planned, behind the USB
+        adapter's or the OS's buffering, while the next one is on time. So
+        the model lets each command be taken out as if it had arrived up to
+        jitter seconds late.
+    """
+
+    # _SS_MAX_RX_BUFF in the tile firmware
+    TILE_RX_BUFFER = 32
+    # one pass of the tile loop on ls_bm2014 hardware - the floor used to wait 5ms
+    # (OURWAIT) between tiles, each sent a color and a shape, as the fastest it ran
+    # on 24 tiles over two ports without serial corruption, so 2.5ms a command
+    TILE_LOOP_TIME = 0.0025
+    # how much later than planned a write may reach the wire
+    JITTER = 0.005
+
+    def __init__(self, baud, loopTime=TILE_LOOP_TIME, capacity=TILE_RX_BUFFER, jitter=JITTER):
+        # 10 bits on the wire per byte - start bit, 8 data bits, stop bit
+        self.rate = baud / 10
+        self.loopTime = loopTime
+        self.capacity = capacity
+        self.jitter = jitter
+        self.wireFree = 0.0     # when the bytes written so far have all arrived
+        self.lastTaken = 0.0    # when the last command is taken out of the buffer
+        self.buffered = deque() # (bytes, time taken out) of the commands in the buffer
+        self.waited = 0         # total seconds writes were held back
+
+    def take(self, count, reply=0):
+        """
+            Accounts for a command of count bytes, answered by reply bytes.
+            Returns how many seconds to wait before writing it so the tiles'
+            buffer does not overrun. Afterwards lastTaken is when its reply
+            should be in.
+        """
+        now = time.monotonic()
+        # the port would start sending it then, if it were written now
+        ready = max(now, self.wireFree)
+        start = ready
+        held = 0
+        for (size, taken) in self.buffered:
+            held += size
+        # a query goes out behind the commands still in the buffer, its reply comes after them
+        while len(self.buffered) > 0 and (self.buffered[0][1] <= start or held + count > self.capacity):
+            (size, taken) = self.buffered.popleft()
+            held -= size
+            start = max(start, taken)
+        self.wireFree = start + count / self.rate
+        # the pass that runs the command also writes its reply
+        self.lastTaken = max(self.wireFree + self.jitter, self.lastTaken) + self.loopTime + reply / self.rate
+        self.buffered.append((count, self.lastTaken))
+        if start > ready:
+            return start - now
+        return 0.0
+
+    def write(self, mySerial, data, reply=0):
+        """
+            Writes data to the serial port, as few writes as the pacing allows.
+            Returns when the reply to the last command should be in.
+        """
+        chunk = bytearray()
+        idx = 0
+        while idx < len(data):
+            # low 3 bits count the bytes after the address and command bytes
+            size = min((data[idx] & 0x07) + 2, len(data) - idx)
+            last = idx + size >= len(data)
+            delay = self.take(size, reply if last else 0)
+            if delay > 0:
+                if len(chunk) > 0:
+                    mySerial.write(bytes(chunk))
+                    chunk = bytearray()
+                time.sleep(delay)
+                self.waited += delay
+            chunk += data[idx:idx + size]
+            idx += size
+        if len(chunk) > 0:
+            mySerial.write(bytes(chunk))
+        return self.lastTaken
+
+
+class LSPortReceiver():
+    """
+        Frames the bytes the tiles send back on one port.
+
+        Bytes that arrive when no response is expected are stale responses
+        or debug output, and are drained without blocking before each query.
+        A tile with debug output on sends CMD_DONE and the command's mode
+        ahead of its response. Debug output can be on from power up, so the
+        receiver goes by the bytes rather than by the LS_DEBUG commands it
+        has seen: it drops the two echo bytes when they are there, and a
+        response that starts with CMD_DONE without the echo after it is some
+        other command's debug output, and is dropped as a missed read.
+    """
+
+    def __init__(self, name, mySerial):
+        self.name = name
+        self.mySerial = mySerial
+        self.readTimeout = getattr(mySerial, "timeout", None) or 0.01
+        self.debugTiles = set()     # addresses with debug output on, 0 for all of them
+        self.chatter = 0            # bytes dropped as stale or debug output
+
+    def sent(self, data):
+        """
+            Watches the packets written to the port for LS_DEBUG commands
+        """
+        idx = 0
+        while idx + 1 < len(data):
+            address = data[idx] & 0xF8
+            if data[idx + 1] == LS_DEBUG and idx + 2 < len(data):
+                if data[idx + 2]:
+                    self.debugTiles.add(address)
+                elif address == 0:
+                    self.debugTiles.clear()
+                else:
+                    self.debugTiles.discard(address)
+            # low 3 bits count the bytes after the address and command bytes
+            idx += (data[idx] & 0x07) + 2
+
+    def drain(self):
+        """
+            Drops whatever is waiting on the port without blocking
+        """
+        waiting = self.mySerial.in_waiting
+        if waiting > 0:
+            thisRead = self.mySerial.read(waiting)
+            self.chatter += len(thisRead)
+            # debug or not, if tile sends something, we want to see it
+            if len(self.debugTiles) > 0:
+                print ("Tile debug output (" + str(self.name) + "): " + ' '.join(format(x, '#02x') for x in thisRead))
+            else:
+                print ("Stale response (" + str(self.name) + "): " + ' '.join(format(x, '#02x') for x in thisRead))
+
+    def receive(self, request):
+        """
+            Reads the response to request, or None if it does not arrive in full
+            within the port's read timeout of when it is due
+        """
+        # the tiles may still have commands to run ahead of it, so keep reading until it is due
+        deadline = (request.replyBy or 0) + self.readTimeout
+        thisRead = self._read(request.count, deadline)
+        if thisRead is None or len(request.data) < 2 or thisRead[0] != CMD_DONE:
+            return thisRead
+        if len(thisRead) == 1:
+            # a one byte response of CMD_DONE, unless the echo follows
+            following = self.mySerial.read(1)
+            if len(following) == 0:
+                return thisRead
+            thisRead += following
+        if thisRead[1] != request.data[1]:
+            # debug output of a command ahead of this one
+            self.chatter += len(thisRead)
+            return None
+        self.chatter += 2
+        self.debugTiles.add(request.data[0] & 0xF8)
+        # the echo took two bytes of wire time ahead of the response
+        more = self._read(request.count - (len(thisRead) - 2), deadline + self.readTimeout)
+        if more is None:
+            return None
+        return thisRead[2:] + more
+
+    # reads count bytes, or None if they are not all in by the deadline
+    def _read(self, count, deadline):
+        thisRead = bytearray()
+        while len(thisRead) < count:
+            thisRead += self.mySerial.read(count - len(thisRead))
+            if len(thisRead) < count and time.monotonic() >= deadline:
+                return None
+        return bytes(thisRead)
+
+
+class LSPortWorker():
+    """
+        Owns one shared serial port and services it from its own thread.
+        The game thread only enqueues commands, so every port on the floor
+        is written and read in parallel.
+
+        With batching on, writes are held until commit() and then sent as
+        one buffer per frame, limited to what the baud rate can carry in a
+        frame. While the port is behind, a display command replaces the
+        pending one of the same kind for the same tile, so only the latest
+        state of each tile waits and the backlog stays bounded.
+    """
+
+    FRAME_GAP = 1 / 30
+    # share of a frame's wire time that one commit may fill
+    FRAME_BUDGET = 0.8
+
+    # queries in flight at once in queryPipelined
+    PIPELINE_DEPTH = 2
+
+    # read timeouts past when its reply is due that wait() gives a query
+    WAIT_READS = 4
+
+    def __init__(self, name, sharedSerial, batching=False, frameGap=FRAME_GAP, loopTime=LSPortPacer.TILE_LOOP_TIME):
+        self.name = name
+        self.mySerial = sharedSerial
+        self.requests = queue.Queue()
+        self.batching = batching
+        # runs of batched commands, see _batch
+        self.pending = []
+        # the run commit() is sending from, nothing more joins it
+        self.draining = None
+        # the last batch committed, no other is committed until the worker has sent it
+        self.committed = None
+        self.lock = threading.Lock()
+        # every write goes through the pacer, so the tiles keep up without fixed delays
+        baud = getattr(sharedSerial, "baudrate", 19200)
+        self.pacer = LSPortPacer(baud, loopTime)
+        self.receiver = LSPortReceiver(name, sharedSerial)
+        self.telemetry = PortTelemetry(name)
+        self.frameBytes = max(1, int(self.pacer.rate * frameGap * self.FRAME_BUDGET))
+        self.readTimeout = getattr(sharedSerial, "timeout", None) or 0.01
+        self.thread = threading.Thread(target=self._run, name="LSPortWorker " + str(name))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, data):
+        """
+            Queues bytes to be written to the port and returns immediately.
+            When batching, they wait for the next commit().
+        """
+        if self.batching:
+            with self.lock:
+                self._batch(bytes(data))
+            return
+        self.requests.put(LSPortRequest(data))
+
+    def commit(self):
+        """
+            Sends the writes batched since the last commit as one write, up to
+            the byte budget of one frame. Commands over the budget stay pending
+            for the next commit, in order. Nothing is committed while the
+            worker is still sending the last commit.
+            Returns the number of bytes committed.
+        """
+        batch = bytearray()
+        with self.lock:
+            if self.committed is not None and not self.committed.done.is_set():
+                return 0
+            while len(self.pending) > 0:
+                run = self.pending[0]
+                if len(run) == 0:
+                    self.pending.pop(0)
+                    continue
+                self.draining = run
+                commands = next(iter(run.values()))
+                if len(batch) > 0 and len(batch) + len(commands[0]) > self.frameBytes:
+                    break
+                batch += commands.pop(0)
+                if len(commands) == 0:
+                    run.popitem(last=False)
+            if len(batch) > 0:
+                self.committed = LSPortRequest(batch)
+                self.requests.put(self.committed)
+        return len(batch)
+
+    def backlog(self):
+        """
+            Returns the number of bytes batched and not yet committed
+        """
+        with self.lock:
+            return sum(len(packet) for run in self.pending for commands in run.values() for packet in commands)
+
+    # adds a packet to the pending runs
+    # each run maps tile address to that tile's commands, in the order tiles first
+    # appear, and a command that sets all it touches replaces the tile's pending
+    # command of the same kind - for segment commands, any that set the same segments,
+    # active or queued, whichever colors they give
+    # a LATCH is kept once, after everything else in its run, so once one is pending
+    # only commands for the latch queue may join the run
+    # once commit() starts on a run it is closed, so a run that is being sent, and its
+    # LATCH, always get to the end, and new frames gather in the run behind it
+    # other broadcasts reach every tile, so they are a run of their own that nothing
+    # is moved across
+    def _batch(self, packet):
+        address = packet[0] & 0xF8
+        command = packet[1] if len(packet) > 1 else None
+        if address == 0 and command != LS_LATCH:
+            self.pending.append(OrderedDict([(None, [packet])]))
+            return
+        segment = command is not None and SEGMENT_CMD <= command <= SEGMENT_CMD_END
+        queued = address == 0 or (segment and command & CONDX_LATCH)
+        if len(self.pending) == 0 or None in self.pending[-1] or self.pending[-1] is self.draining or \
+                (0 in self.pending[-1] and not queued):
+            self.pending.append(OrderedDict())
+        run = self.pending[-1]
+        commands = run.setdefault(address, [])
+        if command in (LS_LATCH, SET_COLOR, SET_SHAPE, SET_TRANSITION):
+            # same address byte, so the same argument count, and the same command
+            commands[:] = [each for each in commands if each[:2] != packet[:2]]
+        elif segment and self._setsAll(packet):
+            commands[:] = [each for each in commands if not self._sameSegments(each, packet)]
+        commands.append(packet)
+        if address == 0:
+            run.move_to_end(0)
+
+    # a segment command sets every field unless one it gives has the keep bit
+    @staticmethod
+    def _setsAll(packet):
+        given = sum(1 for mask in SEGMENT_FIELDS if packet[1] & mask)
+        return all(field & SEGMENT_KEEP_MASK == 0 for field in packet[2:2 + given])
+
+    @staticmethod
+    def _sameSegments(packet, other):
+        if len(packet) < 2 or not SEGMENT_CMD <= packet[1] <= SEGMENT_CMD_END:
+            return False
+        return packet[1] & CONDX_MASK == other[1] & CONDX_MASK
+
+    def query(self, data, count=8):
+        """
+            Queues a command that expects a response of up to count bytes.
+            Returns the LSPortRequest; call wait() on it to get the response.
+        """
+        request = LSPortRequest(data, count, self.WAIT_READS * self.readTimeout)
+        self.requests.put(request)
+        return request
+
+    def queryPipelined(self, packets, count=1):
+        """
+            Queues a group of queries that the port sends back to back, with up
+            to PIPELINE_DEPTH of them in flight, matching responses to requests
+            in order. Each request whose response does not arrive within the
+            port's read timeout is answered with None, and the ones in flight
+            behind it are asked again once the port is quiet.
+            Returns the list of LSPortRequests.
+        """
+        requests = [LSPortRequest(packet, count, self.WAIT_READS * self.readTimeout) for packet in packets]
+        self.requests.put(requests)
+        return requests
+
+    def snapshot(self):
+        """
+            Returns the port's traffic counters, see LSTelemetry.PortTelemetry
+        """
+        self.telemetry.paceWait = self.pacer.waited
+        self.telemetry.staleBytes = self.receiver.chatter
+        return self.telemetry.snapshot()
+
+    def flush(self):
+        """
+            Blocks until everything queued so far has been sent
+        """
+        self.requests.join()
+
+    def close(self):
+        """
+            Finishes any queued commands, stops the worker thread and closes the port
+        """
+        while True:
+            # wait for the last commit to go out, then commit what is left
+            self.flush()
+            if self.commit() == 0:
+                break
+        self.requests.put(None)
+        self.thread.join()
+        self.mySerial.close()
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            try:
+                if request is None:
+                    return
+                if isinstance(request, list):
+                    self._pipeline(request)
+                else:
+                    self._service(request)
+            except serial.SerialException as e:
+                print("Serial Exception on port: " + str(self.name) + " (" + str(e) + ")")
+            except Exception as e:
+                # keep the worker alive, the requests it dropped are answered as missed reads
+                print("Port worker error on port: " + str(self.name) + " (" + repr(e) + ")")
+            finally:
+                if isinstance(request, list):
+                    for each in request:
+                        each.done.set()
+                elif request is not None:
+                    request.done.set()
+                self.requests.task_done()
+
+    def _service(self, request):
+        if request.count == 0:
+            self._send(request)
+            return
+        if len(request.data) == 0:
+            # a bare read takes whatever arrives, debug output included
+            request.replyBy = time.monotonic()
+            request.response = self.mySerial.read(request.count)
+            return
+        self.receiver.drain()
+        sent = self._send(request)
+        request.response = self.receiver.receive(request)
+        self.telemetry.answered(request, time.monotonic() - sent)
+
+    # writes a request's bytes and returns when they were handed to the port
+    def _send(self, request):
+        request.replyBy = self.pacer.write(self.mySerial, request.data, request.count)
+        self.receiver.sent(request.data)
+        self.telemetry.wrote(request.data)
+        return time.monotonic()
+
+    def _pipeline(self, requests):
+        self.receiver.drain()
+
+        toSend = deque(requests)
+        inFlight = deque()
+        while len(toSend) > 0 or len(inFlight) > 0:
+            # keep the next requests going out while waiting on the oldest response
+            while len(toSend) > 0 and len(inFlight) < self.PIPELINE_DEPTH:
+                request = toSend.popleft()
+                inFlight.append((request, self._send(request)))
+            (request, sent) = inFlight.popleft()
+            request.response = self.receiver.receive(request)
+            self.telemetry.answered(request, time.monotonic() - sent)
+            request.done.set()
+            if request.response is None and (len(inFlight) > 0 or len(toSend) > 0):
+                # responses are matched by order, so a late byte for this request would be
+                # read as the next one's and shift every one after it - let what is still
+                # coming arrive, drop it and ask the requests in flight again
+                quiet = max([request.replyBy] + [each.replyBy for (each, sent) in inFlight])
+                time.sleep(max(0, quiet - time.monotonic()) + self.readTimeout)
+                self.receiver.drain()
+                while len(inFlight) > 0:
+                    resend = inFlight.pop()[0]
+                    resend.replyBy = None
+                    toSend.appendleft(resend)
@@ -1,10 +1,25 @@
 ### Implementation of the Lightsweeper floor
 from LSRealTile import LSRealTile
 from LSRealTile import lsOpen
+from LSRealTile import ADC_MIN
+from LSRealTile import ADC_MAX
+from LSRealTile import ADC_THRESH
+from LSRealTile import MAX_ERRORS
+from LSRealTile import STATUS_ERR_MASK
+from LSPortWorker import LSPortWorker
+from LSPortWorker import LSPortPacer
+from LSFrameClock import wait
+from LSSensorScheduler import SensorScheduler
+from LSSensorEvents import SensorEvents
+from LSTelemetry import formatSnapshot
+from LSCapture import CaptureFile
+from LSCapture import CaptureSerial
 
 import time
 import os
 import random
+import threading
+from collections import deque
 import Colors
 import Shapes
 from Move import Move
@@ -12,17 +27,29 @@ from LSAudio import Audio
 from LSFloorConfigure import lsFloorConfig
 from LSFloorConfigure import userSelect
 
-# Maximum speed of loop before serial corruption (on 24 tiles split between two com ports)
-OURWAIT = 0.005
-
 #handles all communications with RealTile objects, serving as the interface to the
 #actual lightsweeper floor. thus updates are pushed to it (display) and also pulled from it
 #(sensor changes)
 class LSRealFloor():
     SENSOR_THRESHOLD = 100
+    # calibrations with a smaller spread than this are not trusted
+    MIN_CALIBRATION_SPREAD = 10
+    # seconds between integrity checks, and tiles per port sampled by each one
+    INTEGRITY_PERIOD = 1.0
+    INTEGRITY_SAMPLE = 4
     sharedSerials = dict()
 
-    def __init__(self, rows, cols, serials=None, configFile=None):
+    # fastStart trusts the port and address mapping in the configuration instead of
+    # scanning for tiles, and checks that the tiles answer in the background
+    # without it the ports are scanned, through lsOpen's verified saved port map
+    # integrityCheck samples tile error registers in the background and resends what was lost
+    # telemetryPeriod, in seconds, prints the port traffic counters that often from heartbeat
+    # capture names a file that every byte written to and read from the ports is logged to
+    # tileLoopTime is how long a pass of the tile firmware's loop takes, the ports send no
+    # faster than one command per pass so the tiles' receive buffers never overrun
+    # maxLatency is the longest, in seconds, a step on any tile may take to be reported
+    def __init__(self, rows, cols, serials=None, configFile=None, frameCommit=False, fastStart=False, integrityCheck=True,
+                 telemetryPeriod=None, capture=None, tileLoopTime=LSPortPacer.TILE_LOOP_TIME, maxLatency=0.1):
         if configFile is None:
             floorFiles = list(filter(lambda ls: ls.endswith(".floor"), os.listdir()))
             if len(floorFiles) is 0:
@@ -38,12 +65,47 @@ class LSRealFloor():
 
         # Load the configuration
         conf = lsFloorConfig(fileName)
+        self.conf = conf
         self.rows = conf.rows
         self.cols = conf.cols
         print("RealFloor init", self.rows, self.cols)
 
-        # Initialize the serial ports
-        tilepile = lsOpen()
+        # Initialize the serial ports, each one serviced by its own worker thread
+        # writes are batched into one buffer per port per heartbeat
+        if fastStart:
+            portmap = dict()
+            for row in conf.board:
+                for col in conf.board[row]:
+                    (port, address) = conf.board[row][col]
+                    portmap.setdefault(port, set()).add(address)
+            tilepile = lsOpen(portmap=portmap)
+        else:
+            tilepile = lsOpen()
+        self.ports = dict()
+        # address 0 tiles for broadcast commands, one per port
+        self.broadcastTiles = dict()
+        self.capture = None
+        if capture is not None:
+            self.capture = CaptureFile(capture)
+        for port in tilepile.sharedSerials:
+            sharedSerial = tilepile.sharedSerials[port]
+            if self.capture is not None:
+                sharedSerial = CaptureSerial(sharedSerial, self.capture, port)
+            self.ports[port] = LSPortWorker(port, sharedSerial, batching=True, loopTime=tileLoopTime)
+            self.broadcastTiles[port] = LSRealTile(self.ports[port])
+            self.broadcastTiles[port].assignAddress(0)
+        self.frameCommit = False
+        self.latchPorts = set()
+        # tiles found with command errors, resent by the next heartbeat
+        self.repairs = deque()
+        self.corruptions = 0
+        self.telemetryPeriod = telemetryPeriod
+        self.telemetryDumped = time.monotonic()
+        self.lastTelemetry = dict()
+        # press and release events from the readings
+        self.sensorEvents = SensorEvents()
+        # which tiles get polled each frame
+        self.scheduler = SensorScheduler(self.rows, self.cols, maxLatency=maxLatency, debounce=self.sensorEvents.debounce)
 
         self.addressToRowColumn = {}
         # make all the rows
@@ -55,42 +117,230 @@ class LSRealFloor():
             self.tileAddresses = []
             for col in conf.board[row]:
                 (port, address) = conf.board[row][col]
-                tile = LSRealTile(tilepile.sharedSerials[port])
+                tile = LSRealTile(self.ports[port])
                 tile.comNumber = port
 
                 tile.assignAddress(address)
                 self.addressToRowColumn[(address,port)] = (row, col)
-                tile.setColor(Colors.WHITE)
-                tile.setShape(Shapes.ZERO)
-                print("address assigned:", tile.getAddress())
+                if fastStart:
+                    # set for the whole port at once below
+                    tile.color = Colors.WHITE
+                    tile.shape = Shapes.ZERO
+                else:
+                    tile.set(Colors.WHITE, Shapes.ZERO)
+                    print("address assigned:", tile.getAddress())
                 tiles.append(tile)
-                wait(.1)
             self.tileRows.append(tiles)
-            
+
+        self.missingTiles = set()
+        if fastStart:
+            for port in self.broadcastTiles.values():
+                port.set(Colors.WHITE, Shapes.ZERO)
+            self.heartbeat()
+            self.tileCheck = threading.Thread(target=self.checkTiles, name="LSRealFloor tile check")
+            self.tileCheck.daemon = True
+            self.tileCheck.start()
+
+        self.loadCalibration()
+
+        if frameCommit:
+            self.setFrameCommit(True)
+        self.heartbeat()
+
+        self.integrityNext = dict()
+        self.closing = threading.Event()
+        self.integrityThread = None
+        if integrityCheck:
+            self.integrityThread = threading.Thread(target=self._integrityLoop, name="LSRealFloor integrity check")
+            self.integrityThread.daemon = True
+            self.integrityThread.start()
         return
 
+    # checks that every tile in the configuration answers a version query
+    # tiles that do not are listed in missingTiles by (row, col)
+    def checkTiles(self):
+        requests = []
+        for (port, portTiles) in self._tilesByPort(self._getTileList(0,0)).items():
+            packets = [tile.versionCommand() for tile in portTiles]
+            requests.extend(zip(portTiles, self.ports[port].queryPipelined(packets, 2)))
+        missing = set()
+        for (tile, request) in requests:
+            if not request.wait():
+                rowCol = self.addressToRowColumn[(tile.address, tile.comNumber)]
+                print("No answer from tile " + repr(rowCol) + " at address " + repr(tile.address) + " on " + str(tile.comNumber))
+                missing.add(rowCol)
+        self.missingTiles = missing
+        if len(missing) == 0:
+            print("All " + str(len(requests)) + " tiles answered")
+        return missing
+
+    # samples TILE_STATUS from a few tiles on each port, round robin, and reads back the
+    # error queue of any tile with the error bit set, which also clears it
+    # those tiles dropped or mangled a command, so their color and shape are resent
+    # returns the list of (row, col) found with errors
+    def checkIntegrity(self, sample=INTEGRITY_SAMPLE):
+        statusRequests = []
+        for (port, portTiles) in self._tilesByPort(self._getTileList(0,0)).items():
+            start = self.integrityNext.get(port, 0) % len(portTiles)
+            sampled = (portTiles[start:] + portTiles[:start])[:sample]
+            self.integrityNext[port] = start + len(sampled)
+            packets = [tile.statusCommand() for tile in sampled]
+            statusRequests.extend(zip(sampled, self.ports[port].queryPipelined(packets, 1)))
+
+        errorRequests = []
+        for (tile, request) in statusRequests:
+            status = tile.sensorValue(request.wait())
+            if status is not None and status & STATUS_ERR_MASK:
+                errorRequests.append((tile, self.ports[tile.comNumber].query(tile.errorsCommand(), MAX_ERRORS)))
+
+        damaged = []
+        for (tile, request) in errorRequests:
+            errors = request.wait()
+            rowCol = self.addressToRowColumn[(tile.address, tile.comNumber)]
+            if errors:
+                print("Tile " + repr(rowCol) + " command errors: " + ' '.join(format(x, '#02x') for x in errors))
+            self.repairs.append(tile)
+            self.corruptions += 1
+            damaged.append(rowCol)
+        return damaged
+
+    def telemetry(self):
+        """
+            Returns a snapshot of the traffic counters of every port, by port
+        """
+        return {port: worker.snapshot() for (port, worker) in self.ports.items()}
+
+    # prints one line per port with rates since the last dump, and the tiles that timed out
+    def dumpTelemetry(self):
+        snapshots = self.telemetry()
+        for (port, snapshot) in sorted(snapshots.items()):
+            last = self.lastTelemetry.get(port)
+            print(formatSnapshot(snapshot, last))
+            for (address, tile) in sorted(snapshot["tiles"].items()):
+                timeouts = tile["timeouts"]
+                if last is not None and address in last["tiles"]:
+                    timeouts -= last["tiles"][address]["timeouts"]
+                if timeouts > 0 and (address, port) in self.addressToRowColumn:
+                    print("    tile " + repr(self.addressToRowColumn[(address, port)]) + " at address " + repr(address) + ": " + str(timeouts) + " timeouts")
+        self.lastTelemetry = snapshots
+        self.telemetryDumped = time.monotonic()
+        return snapshots
+
+    def _integrityLoop(self):
+        while not self.closing.wait(self.INTEGRITY_PERIOD):
+            self.checkIntegrity()
+
+    # sets the per tile sensor thresholds from the ADC statistics each tile keeps, read with
+    # ADC_MIN, ADC_MAX and ADC_THRESH - the firmware never writes EE_ADC_MIN and EE_ADC_MAX
+    # tiles are only read if they are missing from the floor's calibration cache, or refresh is set
+    # only calibrations that pass _calibrationOk are cached, so the others are read again next time
+    def loadCalibration(self, refresh=False):
+        self.thresholds = dict()
+        cached = dict() if refresh else self.conf.loadCalibration()
+        calibration = {key: values for (key, values) in cached.items() if self._calibrationOk(*values)}
+        tiles = self._getTileList(0,0)
+        missing = [tile for tile in tiles if (tile.comNumber, tile.address) not in calibration]
+        if len(missing) > 0:
+            print("Reading sensor calibration from " + str(len(missing)) + " tiles")
+            requests = []
+            for (port, portTiles) in self._tilesByPort(missing).items():
+                packets = []
+                for tile in portTiles:
+                    packets.append(tile.adcStatCommand(ADC_MIN))
+                    packets.append(tile.adcStatCommand(ADC_MAX))
+                    packets.append(tile.adcStatCommand(ADC_THRESH))
+                portRequests = self.ports[port].queryPipelined(packets, 1)
+                requests.extend(zip(portTiles, portRequests[0::3], portRequests[1::3], portRequests[2::3]))
+            for (tile, minRequest, maxRequest, threshRequest) in requests:
+                values = [tile.sensorValue(request.wait()) for request in (minRequest, maxRequest, threshRequest)]
+                if None not in values and self._calibrationOk(*values):
+                    calibration[(tile.comNumber, tile.address)] = tuple(values)
+        if calibration != cached:
+            try:
+                self.conf.writeCalibration(calibration)
+            except IOError as e:
+                print(e)
+        for tile in tiles:
+            if (tile.comNumber, tile.address) in calibration:
+                rowCol = self.addressToRowColumn[(tile.address, tile.comNumber)]
+                self.thresholds[rowCol] = calibration[(tile.comNumber, tile.address)][2]
+
+    # stepping on a tile lowers the reading, so its threshold has to sit inside a usable
+    # spread - unset statistics read 0xFF for both, and fail
+    def _calibrationOk(self, adcMin, adcMax, threshold):
+        return adcMax - adcMin >= self.MIN_CALIBRATION_SPREAD and adcMin < threshold < adcMax
+
+    # in frame commit mode, tile updates are queued in the tiles with the latch condition
+    # and heartbeat shows them all at once with one broadcast latch per port
+    def setFrameCommit(self, enabled):
+        self.heartbeat()
+        self.frameCommit = enabled
+        for row in self.tileRows:
+            for tile in row:
+                color = tile.getColor()
+                shape = tile.getShape()
+                if enabled:
+                    # queue what each tile shows now so the first latch does not blank it
+                    tile.queued = None
+                    self._queue(tile, color, shape)
+                else:
+                    # the latched segments only reach the tile at a LATCH, resend them immediately
+                    tile.color = None
+                    tile.shape = None
+                    tile.set(color, shape)
+        self.heartbeat()
+
+    def _queue(self, tile, color, shape):
+        if tile.setColorShape(color, shape, conditionLatch=True):
+            self.latchPorts.add(tile.comNumber)
+
     def heartbeat(self):
-        pass
+        # resend the state of tiles the integrity check found errors on
+        while len(self.repairs) > 0:
+            tile = self.repairs.popleft()
+            if tile.resend(self.frameCommit) and self.frameCommit:
+                self.latchPorts.add(tile.comNumber)
+        # commit the frame - everything queued since the last heartbeat shows at once
+        for port in self.latchPorts:
+            self.broadcastTiles[port].latch()
+        self.latchPorts.clear()
+        # then each port writes the frame as a single buffer
+        for port in self.ports.values():
+            port.commit()
+        if self.telemetryPeriod is not None and time.monotonic() - self.telemetryDumped >= self.telemetryPeriod:
+            self.dumpTelemetry()
 
     def setAllColor(self, color):
         for row in self.tileRows:
             for tile in row:
-                tile.setColor(color)
+                if self.frameCommit:
+                    self._queue(tile, color, tile.getShape())
+                else:
+                    tile.set(color=color)
 
 
+    # color and shape go out in a single packet
     def set(self, row, col, shape, color):
         tile = self.tileRows[row][col];
-        tile.setColor(color)
-        tile.setShape(shape)
+        if self.frameCommit:
+            self._queue(tile, color, shape)
+            return
+        tile.set(color, shape)
 
     def setColor(self, row, col, color):
         tile = self.tileRows[row][col]
-        tile.setColor(color)
+        if self.frameCommit:
+            self._queue(tile, color, tile.getShape())
+            return
+        tile.set(color=color)
 
 
     def setShape(self, row, col, shape):
         tile = self.tileRows[row][col]
-        tile.setShape(shape)
+        if self.frameCommit:
+            self._queue(tile, tile.getColor(), shape)
+            return
+        tile.set(shape=shape)
 
 
     def setSegmentsCustom(self, row, col, segments):
@@ -103,43 +353,43 @@ class LSRealFloor():
             for tile in row:
                 tile.setColor(Colors.RED)
                 tile.setShape(126)
-                wait(OURWAIT)
+        self.heartbeat()
         wait(updateFrequency)
         for row in self.tileRows:
             for tile in row:
                 tile.setColor(Colors.YELLOW)
                 tile.setShape(126)
-                wait(OURWAIT)
+        self.heartbeat()
         wait(updateFrequency)
         for row in self.tileRows:
             for tile in row:
                 tile.setColor(Colors.GREEN)
                 tile.setShape(126)
-                wait(OURWAIT)
+        self.heartbeat()
         wait(updateFrequency)
         for row in self.tileRows:
             for tile in row:
                 tile.setColor(Colors.CYAN)
                 tile.setShape(126)
-                wait(OURWAIT)
+        self.heartbeat()
         wait(updateFrequency)
         for row in self.tileRows:
             for tile in row:
                 tile.setColor(Colors.BLUE)
                 tile.setShape(126)
-                wait(OURWAIT)
+        self.heartbeat()
         wait(updateFrequency)
         for row in self.tileRows:
             for tile in row:
                 tile.setColor(Colors.VIOLET)
                 tile.setShape(126)
-                wait(OURWAIT)
+        self.heartbeat()
         wait(updateFrequency)
         for row in self.tileRows:
             for tile in row:
                 tile.setColor(Colors.WHITE)
                 tile.setShape(126)
-                wait(OURWAIT)
+        self.heartbeat()
         wait(updateFrequency)
 
 
@@ -152,17 +402,41 @@ class LSRealFloor():
             s = ""
 
 
+    # tiles the game cares about, polled every frame along with tiles near recent steps
+    def setLiveTiles(self, cells):
+        self.scheduler.setLiveTiles(cells)
+
     def pollSensors(self):
         sensorsChanged = []
-        tiles = self._getTileList(0,0)
-        for tile in tiles:
-            val = tile.sensorStatus()
-            if val < self.SENSOR_THRESHOLD:
-                rowCol = self.addressToRowColumn[(tile.address, tile.comNumber)]
-                move = Move(rowCol[0], rowCol[1], val)
+        tiles = [self.tileRows[row][col] for (row, col) in self.scheduler.nextTiles()]
+        # queue every read first so the port workers poll their ports in parallel,
+        # each one pipelining the reads for its own tiles
+        requests = []
+        for (port, portTiles) in self._tilesByPort(tiles).items():
+            packets = [tile.sensorCommand() for tile in portTiles]
+            requests.extend(zip(portTiles, self.ports[port].queryPipelined(packets, 1)))
+        for (tile, request) in requests:
+            val = tile.sensorValue(request.wait())
+            if val is None:
+                # missed read, the tile did not answer in time
+                continue
+            rowCol = self.addressToRowColumn[(tile.address, tile.comNumber)]
+            threshold = self.thresholds.get(rowCol, self.SENSOR_THRESHOLD)
+            if val < threshold or self.sensorEvents.isPressed(rowCol):
+                # keep polling it every frame to confirm the press or catch the release
+                self.scheduler.markStep(rowCol[0], rowCol[1])
+            pressed = self.sensorEvents.update(rowCol, val, threshold)
+            if pressed is not None:
+                move = Move(rowCol[0], rowCol[1], val, pressed)
                 sensorsChanged.append(move)
         return sensorsChanged
 
+    def _tilesByPort(self, tiles):
+        tilesByPort = dict()
+        for tile in tiles:
+            tilesByPort.setdefault(tile.comNumber, []).append(tile)
+        return tilesByPort
+
     def _getTileList(self,row,column):
         tileList = []
         #whole floor
@@ -192,18 +466,11 @@ class LSRealFloor():
 
 
     def clearboard(self):
-        zeroTile = LSRealTile(self.sharedSerials[0])
-        zeroTile.assignAddress(0)
-        zeroTile.blank()
-        zeroTile = LSRealTile(self.sharedSerials[1])
-        zeroTile.assignAddress(0)
-        zeroTile.blank()
-        zeroTile = LSRealTile(self.sharedSerials[2])
-        zeroTile.assignAddress(0)
-        zeroTile.blank()
-        zeroTile = LSRealTile(self.sharedSerials[3])
-        zeroTile.assignAddress(0)
-        zeroTile.blank()
+        for port in self.ports.values():
+            zeroTile = LSRealTile(port)
+            zeroTile.assignAddress(0)
+            zeroTile.blank()
+        self.heartbeat()
 
 
     def RAINBOWMODE_NoAddress(self, interval):
@@ -223,7 +490,7 @@ class LSRealFloor():
                 tile = LSRealTile(self.sharedSerials[com])
                 tile.assignAddress(addy * 8)
                 val = tile.sensorStatus()
-                if val < self.SENSOR_THRESHOLD:
+                if val is not None and val < self.SENSOR_THRESHOLD:
                     print("sensor sensed", val)
                     sensorsChanged.append((addy * 8, com))
                 polled += 1
@@ -252,11 +519,16 @@ class LSRealFloor():
         return
 
 
-def wait(seconds):
-    # self.pollSensors()
-    currentTime = time.time()
-    while time.time() - currentTime < seconds:
-        pass
+    # waits for the port workers to finish what is queued, then closes the ports
+    def close(self):
+        self.closing.set()
+        if self.integrityThread is not None:
+            self.integrityThread.join()
+        for port in self.ports.values():
+            port.close()
+        if self.capture is not None:
+            self.capture.close()
+
 
 def playRandom8bitSound(audio):
     val = random.randint(0, 10)
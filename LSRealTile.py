@@ -2,6 +2,7 @@
 
 # the API is the base class
 from LSTileAPI import *
+from LSPortWorker import LSPortWorker
 
 import serial
 from serial.tools import list_ports
@@ -11,6 +12,9 @@ from serial.tools import list_ports
 import os
 import time
 
+import json
+from concurrent.futures import ThreadPoolExecutor
+
 # TODO - perhaps better to use hexlify and unhexlify
 #from HexByteConversion import *
 
@@ -48,7 +52,10 @@ LS_RANDOM_ADDRESS  = (LS_LATCH+0xF)
 LS_RANDOM_ADDRESS2 = (0xD4)
 
 # seven segment display commands with one data byte
-SET_COLOR      = 0x20          # set the tile color - format TBD
+SET_COLOR      = 0x20          # set the tile color - use mask bits below
+COLOR_RED_MASK   = 1
+COLOR_GREEN_MASK = 2
+COLOR_BLUE_MASK  = 4
 SET_SHAPE      = (SET_COLOR+1) # set which segments are "on" - abcdefg-
 SET_TRANSITION = (SET_COLOR+2) # set transition at the next refresh - format TBD
 # seven segment display commands with three data bytes
@@ -157,6 +164,20 @@ TRANSITION_FIELD_MASK = 0x01
 # 0x80
 
 
+# rgb segment fields that draw shape in a single SET_COLOR style color
+# missing color or shape is treated as off
+def colorShapeSegments(color, shape):
+    color = color or 0
+    shape = shape or 0
+    rgb = [0, 0, 0]
+    if color & COLOR_RED_MASK:
+        rgb[0] = shape
+    if color & COLOR_GREEN_MASK:
+        rgb[1] = shape
+    if color & COLOR_BLUE_MASK:
+        rgb[2] = shape
+    return rgb
+
 
 ### Implementation of the Lightsweeper low level API to a ATTiny tile
 class LSRealTile(LSTileAPI):
@@ -165,10 +186,16 @@ class LSRealTile(LSTileAPI):
         self.row = row
         self.col = col
         self.mySerial = sharedSerial
+        self.myPort = None
+        if isinstance(sharedSerial, LSPortWorker):
+            # commands are queued and sent from the port's own thread
+            self.myPort = sharedSerial
+            self.mySerial = sharedSerial.mySerial
         # cmdNargs is address + command + N optional bytes
         self.Debug = False
         self.shape = None
         self.color = None
+        self.queued = None  # (color, shape) waiting in the tile for the next LATCH
         if sharedSerial is None:
             print("Shared serial is None")
             
@@ -251,12 +278,45 @@ class LSRealTile(LSTileAPI):
         self.__tileWrite(args)
 
 
-    def set(self,color=0, shape=0, transition=0):
-        raise NotImplementedError()
-        if (color != 0):
-            self.setColor(color)
-        if (shape != 0 ):
-            self.setShape(shape)
+    # color and shape in one segment command, optionally held until the next LATCH
+    # SET_COLOR and SET_SHAPE always apply immediately, so latched updates must come through here
+    # returns True if anything was sent
+    def setColorShape(self, color, shape, conditionLatch = False):
+        if conditionLatch:
+            if self.queued == (color, shape):
+                return False
+            self.queued = (color, shape)
+        self.setSegments(colorShapeSegments(color, shape), conditionLatch)
+        self.color = color
+        self.shape = shape
+        return True
+
+    # sends the cached color and shape again, for tiles that lost or mangled a command
+    def resend(self, conditionLatch = False):
+        if self.color is None or self.shape is None:
+            return False
+        self.queued = None
+        return self.setColorShape(self.color, self.shape, conditionLatch)
+
+    # set color and shape together in one packet
+    # None keeps the current value, so 0 (black, or no segments) can be set
+    # the ls_bm2014 firmware does not implement SET_TILE yet, so this uses an
+    # immediate segment command which carries both in one write
+    def set(self,color=None, shape=None, transition=0):
+        if color is None:
+            color = self.color
+        if shape is None:
+            shape = self.shape
+        if color is None or shape is None:
+            # until both are known, fall back to the single value commands
+            if color is not None:
+                self.setColor(color)
+            if shape is not None:
+                self.setShape(shape)
+        elif color != self.color or shape != self.shape:
+            # once segment commands are used the firmware's SET_COLOR/SET_SHAPE
+            # state is stale, so every later change has to go through here too
+            self.setColorShape(color, shape)
         if(transition != 0):
             self.setTransition(transition)
         return
@@ -288,9 +348,8 @@ class LSRealTile(LSTileAPI):
     def version(self):
         # send version command
         cmd = TILE_VERSION
-        self.__tileWrite([cmd], True)  # do not eat output
         # return response
-        val = self.__tileRead()
+        val = self.__tileQuery([cmd], 2)
         return val
     
     # eeAddr and datum from 0 to 255
@@ -311,18 +370,16 @@ class LSRealTile(LSTileAPI):
     def eepromRead(self,eeAddr):
         # send read command
         cmd = EEPROM_READ
-        self.__tileWrite([cmd, eeAddr], True)  # do not eat output
         # return response
-        val = self.__tileRead()
+        val = self.__tileQuery([cmd, eeAddr], 1)
         return val
 
     # read any saved errors
     def errorRead(self):
         # send read command
         cmd = RETURN_ERRORS
-        self.__tileWrite([cmd], True)  # do not eat output
         # return response
-        val = self.__tileRead()
+        val = self.__tileQuery([cmd], MAX_ERRORS)
         return val
 
     def blank(self):
@@ -353,16 +410,51 @@ class LSRealTile(LSTileAPI):
         cmd = FLIP_OFF
         self.__tileWrite([cmd])
 
+    # returns this tile's traffic counters from its port worker, or None without one
+    def telemetry(self):
+        if self.myPort is None:
+            return None
+        return self.myPort.snapshot()["tiles"].get(self.address)
+
+    # returns the bit mapped TILE_STATUS, or None if the tile did not answer
     def status(self):
-        raise NotImplementedError()
-        return
+        thisRead = self.__tileQuery([TILE_STATUS], 1)
+        return self.sensorValue(thisRead)
         
     def sensorStatus(self):
         #self.__tileWrite([SENSOR_NOW], True)  # do not eat output
         #self.__tileWrite([EEPROM_READ, 0], True)  # REMOVEME - may use for testing with no sensor
-        self.__tileWrite([ADC_NOW], True)  # do not eat output
         # return response
-        thisRead = self.__tileRead(1) # request more than 1 byte means waiting for timeout
+        thisRead = self.__tileQuery([ADC_NOW], 1) # request more than 1 byte means waiting for timeout
+        return self.sensorValue(thisRead)
+
+    # the addressed ADC_NOW packet, for floors that queue many sensor reads at once
+    # the response is turned into a reading with sensorValue()
+    def sensorCommand(self):
+        return self.__tilePacket([ADC_NOW])
+
+    # the addressed TILE_VERSION packet, answered with two bytes
+    def versionCommand(self):
+        return self.__tilePacket([TILE_VERSION])
+
+    # the addressed TILE_STATUS packet, answered with one byte
+    def statusCommand(self):
+        return self.__tilePacket([TILE_STATUS])
+
+    # the addressed RETURN_ERRORS packet, answered with MAX_ERRORS bytes
+    def errorsCommand(self):
+        return self.__tilePacket([RETURN_ERRORS])
+
+    # the addressed EEPROM_READ packet, answered with one byte like sensorCommand
+    def eepromReadCommand(self, eeAddr):
+        return self.__tilePacket([EEPROM_READ, eeAddr])
+
+    # the addressed ADC_MIN, ADC_MAX or ADC_THRESH packet, answered with one byte like sensorCommand
+    def adcStatCommand(self, stat):
+        return self.__tilePacket([stat])
+
+    # returns None if the tile did not answer
+    def sensorValue(self, thisRead):
         #print ("Sensor status = " + ' '.join(format(x, '#02x') for x in thisRead))
         #if thisRead != None:
         if thisRead:
@@ -370,7 +462,7 @@ class LSRealTile(LSTileAPI):
                 intVal = int(x)
                 return intVal #x # val
         # yikes - no return on read from tile?
-        return 234
+        return None
         
     def reset(self):
         versionCmd = LS_RESET
@@ -388,6 +480,9 @@ class LSRealTile(LSTileAPI):
 
         # sync command is two adjacent NOP_MODE commands
         args = [0, NOP_MODE]  # use global address
+        if self.myPort is not None:
+            self.myPort.write(args + args)
+            return
         count = self.mySerial.write(args)
         count = self.mySerial.write(args)
         if self.Debug:
@@ -445,17 +540,20 @@ class LSRealTile(LSTileAPI):
         if self.mySerial == None:
             return
 
-        # flush stale read data if response is expected
-        if (expectResponse):
-            thisRead = self.mySerial.read(8)
+        if self.myPort is not None:
+            # the port worker sends it from its own thread
+            self.myPort.write(self.__tilePacket(args))
+            return
+
+        # flush stale read data if response is expected, without waiting for more
+        if (expectResponse) and self.mySerial.in_waiting > 0:
+            thisRead = self.mySerial.read(self.mySerial.in_waiting)
             if len(thisRead) > 0:
                 # debug or not, if tile sends something, we want to see it
                 if True or self.Debug:
                     print ("Stale response (" + self.mySerial.port + "->" + repr(self.getAddress()) + "): " + ' '.join(format(x, '#02x') for x in thisRead))
 
-        # insert address byte plus optional arg count
-        addr = self.address + len(args) - 1  # command is not counted
-        args.insert(0, addr)
+        args = self.__tilePacket(args)
         count = self.mySerial.write(args)
         if self.Debug:
             writeStr = (' '.join(format(x, '#02x') for x in args))
@@ -471,10 +569,28 @@ class LSRealTile(LSTileAPI):
                 if True or self.Debug:
                     print ("Debug response: " + ' '.join(format(x, '#02x') for x in thisRead))
 
+    # insert address byte plus optional arg count
+    def __tilePacket(self, args):
+        addr = self.address + len(args) - 1  # command is not counted
+        args.insert(0, addr)
+        return args
+
+    # write a command to the tile and return its response
+    def __tileQuery(self, args, count=8):
+        if self.mySerial == None:
+            return
+        if self.myPort is not None:
+            return self.myPort.query(self.__tilePacket(args), count).wait()
+        self.__tileWrite(args, True)  # do not eat output
+        return self.__tileRead(count)
+
     # read from the tile
     def __tileRead(self, count=8):
         if self.mySerial == None:
             return
+        if self.myPort is not None:
+            # a query with no command just reads on the port worker's thread
+            return self.myPort.query([], count).wait()
         thisRead = self.mySerial.read(count)
         if len(thisRead) > 0:
             if self.Debug:
@@ -492,19 +608,36 @@ class lsOpen:
     """
         This class probes the LS address space and provides methods for
         for discovering and making use of valid lightsweeper serial objects
+
+        All ports are probed at the same time and each port is opened only
+        once. The resulting map is saved in PORTMAP_FILE, and the next time
+        it is only verified against the hardware instead of rescanned.
     """
-    
-    def __init__(self):        
-        self.lsMatrix = self.portmap()
+
+    PORTMAP_FILE = ".lsportmap"
+
+    def __init__(self, useCache=True, portmap=None):
+        self.sharedSerials = {}
+        self.lsMatrix = None
+        if portmap is not None:
+            # trust the caller's map of ports to addresses, open just those ports
+            self.lsMatrix = portmap
+        elif useCache:
+            self.lsMatrix = self.cachedPortmap()
+        if self.lsMatrix is None:
+            self.lsMatrix = self.portmap()
+            self.savePortmap()
         if len(self.lsMatrix) is 0:
             print("Cannot find any lightsweeper tiles")
         if len(self.lsMatrix) is 1:
             print("Only one serial port->" + repr([key for key in self.lsMatrix.keys()]))
         print("There are " + repr(len(self.lsMatrix)) + " valid serial ports.")
-        self.sharedSerials = {}
+        # keep the handles opened while probing, close the ones without tiles
+        for port in list(self.sharedSerials):
+            if port not in self.lsMatrix:
+                self.sharedSerials.pop(port).close()
         for port in self.lsMatrix:
-            newSerial = self.lsSerial(port)
-            self.sharedSerials[newSerial.name] = (newSerial)
+            self._openPort(port)
         print("Shared serials are: " + repr(self.sharedSerials.keys()))  #debugging
 
     def lsSerial(self, port, baud=19200, timeout=0.01):
@@ -523,13 +656,22 @@ class lsOpen:
        # return serialObject
 
 
+    def _openPort(self, port):
+        """
+            Returns the shared serial object for port, opening it the first time
+        """
+        if port not in self.sharedSerials:
+            self.sharedSerials[port] = self.lsSerial(port)
+        return self.sharedSerials[port]
+
+
     def testport(self, port):
         """
             Returns true if port has any lightsweeper objects listening
         """
 
         try:
-            testTile = LSRealTile(self.lsSerial(port))
+            testTile = LSRealTile(self._openPort(port))
         except serial.SerialException:
             print("Serial Exception on port: " + str(port))
             return False
@@ -562,8 +704,12 @@ class lsOpen:
             Returns a generator for all serial ports with lightsweeper tiles attached
         """
 
-        for validPort in list(filter(self.testport,self.availPorts())):
-            yield validPort
+        ports = list(self.availPorts())
+        with ThreadPoolExecutor(max_workers=max(1, len(ports))) as pool:
+            valid = list(pool.map(self.testport, ports))
+        for (validPort, isValid) in zip(ports, valid):
+            if isValid:
+                yield validPort
         
 
     def validAddrs(self, port):
@@ -571,7 +717,7 @@ class lsOpen:
             Returns a generator for valid lightsweeper addresses on provided port
         """
 
-        testTile = LSRealTile(self.lsSerial(port))
+        testTile = LSRealTile(self._openPort(port))
         for address in range(1,32):
             tileAddr = address * 8
             testTile.assignAddress(tileAddr)
@@ -582,9 +728,67 @@ class lsOpen:
     def portmap(self):
         """
             Returns a map of responding lightsweeper tiles and serial ports.
-            
+            Every port is probed in its own thread.
         """
-        return({port:set(self.validAddrs(port)) for port in self.validPorts()})
+        ports = list(self.availPorts())
+        with ThreadPoolExecutor(max_workers=max(1, len(ports))) as pool:
+            found = list(pool.map(self._probePort, ports))
+        return({port:addrs for (port, addrs) in zip(ports, found) if addrs is not None})
+
+
+    def _probePort(self, port):
+        if not self.testport(port):
+            return None
+        return set(self.validAddrs(port))
+
+
+    def cachedPortmap(self):
+        """
+            Returns the port map saved in PORTMAP_FILE if every port in it opens
+            and every tile in it answers, otherwise None.
+        """
+        if not os.path.isfile(self.PORTMAP_FILE):
+            return None
+        try:
+            with open(self.PORTMAP_FILE) as f:
+                saved = {port:set(addrs) for (port, addrs) in json.load(f).items()}
+        except Exception as e:
+            print(e)
+            return None
+        if len(saved) == 0:
+            return None
+        ports = list(saved)
+        with ThreadPoolExecutor(max_workers=max(1, len(ports))) as pool:
+            verified = list(pool.map(lambda port: self._verifyPort(port, saved[port]), ports))
+        if all(verified):
+            print("Verified saved port map from " + self.PORTMAP_FILE)
+            return saved
+        print("Saved port map does not match the tiles, rescanning")
+        return None
+
+
+    def _verifyPort(self, port, addrs):
+        try:
+            testTile = LSRealTile(self._openPort(port))
+        except serial.SerialException:
+            print("Serial Exception on port: " + str(port))
+            return False
+        for tileAddr in addrs:
+            testTile.assignAddress(tileAddr)
+            if not testTile.version():
+                return False
+        return True
+
+
+    def savePortmap(self):
+        """
+            Saves the current port map to PORTMAP_FILE
+        """
+        try:
+            with open(self.PORTMAP_FILE, 'w') as f:
+                json.dump({port:sorted(addrs) for (port, addrs) in self.lsMatrix.items()}, f, sort_keys = True, indent = 4)
+        except IOError as e:
+            print(e)
 
 
     def selectPort(self, portList = None):
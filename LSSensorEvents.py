@@ -0,0 +1,45 @@
+### Turns raw sensor readings into step events
+
+class SensorEvents():
+    """
+        Tracks whether each tile is stepped on and reports only the changes.
+
+        Sensor readings drop when a tile is stepped on. A tile is pressed once
+        debounce reads in a row are below its threshold, and released once
+        debounce reads in a row are at or above threshold + hysteresis, so a
+        reading that wobbles around the threshold does not produce a storm of
+        steps.
+    """
+
+    def __init__(self, hysteresis=10, debounce=2):
+        self.hysteresis = hysteresis
+        self.debounce = debounce
+        self.pressed = set()
+        self.changing = dict()  # (row, col) -> reads in a row that disagree with its state
+
+    def isPressed(self, cell):
+        return cell in self.pressed
+
+    def update(self, cell, val, threshold):
+        """
+            Feeds one reading for the tile at cell = (row, col).
+            Returns True when the tile becomes pressed, False when it is
+            released and None when nothing changed.
+        """
+        if cell in self.pressed:
+            disagrees = val >= threshold + self.hysteresis
+        else:
+            disagrees = val < threshold
+        if not disagrees:
+            self.changing.pop(cell, None)
+            return None
+        count = self.changing.get(cell, 0) + 1
+        if count < self.debounce:
+            self.changing[cell] = count
+            return None
+        self.changing.pop(cell, None)
+        if cell in self.pressed:
+            self.pressed.discard(cell)
+            return False
+        self.pressed.add(cell)
+        return True
@@ -0,0 +1,116 @@
+### Decides which tiles the floor polls for steps each frame
+import math
+import time
+
+class SensorScheduler():
+    """
+        Polls the tiles that matter every frame and the rest round robin.
+
+        Tiles within hotRadius of a step in the last hotTime seconds, and tiles
+        the game has marked as live, are polled every frame. Every other tile
+        is polled often enough that a step on it is reported within maxLatency
+        seconds, so the poll load per frame stays roughly constant as the
+        floor grows. At most maxLive live tiles are polled in a frame, taking
+        turns when the game marks more.
+
+        The budget is in time, not frames: the time between polls is measured,
+        since a poll can take longer than a frame, and a step is only
+        reported after debounce reads, the first of them at the tile's next
+        poll and the rest one poll apart while it is hot.
+    """
+
+    def __init__(self, rows, cols, frameGap=1/30, maxLatency=0.1, hotRadius=1, hotTime=3.0, maxLive=8, debounce=2):
+        self.rows = rows
+        self.cols = cols
+        self.frameGap = frameGap
+        self.maxLatency = maxLatency
+        self.hotRadius = hotRadius
+        self.hotTime = hotTime
+        self.maxLive = maxLive
+        self.live = []
+        self.liveTurn = 0       # index in live of the first tile polled next frame
+        self.steps = dict()     # (row, col) -> time of the most recent step
+        self.debounce = debounce
+        self.cells = [(row, col) for row in range(rows) for col in range(cols)]
+        self.polled = dict()    # (row, col) -> when it was last polled
+        self.gap = frameGap     # seconds between polls, measured
+        self.lastPoll = None
+
+    def setLiveTiles(self, cells):
+        """
+            Tiles whose game state makes a step on them matter, polled every
+            frame up to maxLive of them
+        """
+        live = sorted(set(cells))
+        # games set them every frame, keep the turn going while they stay the same
+        if live != self.live:
+            self.live = live
+            self.liveTurn = 0
+
+    def markStep(self, row, col):
+        self.steps[(row, col)] = time.monotonic()
+
+    def hotTiles(self, now=None):
+        """
+            Returns the set of tiles near a recent step
+        """
+        if now is None:
+            now = time.monotonic()
+        hot = set()
+        for (cell, stepTime) in list(self.steps.items()):
+            if now - stepTime > self.hotTime:
+                del self.steps[cell]
+                continue
+            (row, col) = cell
+            for r in range(max(0, row - self.hotRadius), min(self.rows, row + self.hotRadius + 1)):
+                for c in range(max(0, col - self.hotRadius), min(self.cols, col + self.hotRadius + 1)):
+                    hot.add((r, c))
+        return hot
+
+    def liveTiles(self):
+        """
+            Returns the set of live tiles whose turn it is this frame
+        """
+        if len(self.live) <= self.maxLive:
+            return set(self.live)
+        turn = set()
+        for i in range(self.maxLive):
+            turn.add(self.live[(self.liveTurn + i) % len(self.live)])
+        self.liveTurn = (self.liveTurn + self.maxLive) % len(self.live)
+        return turn
+
+    def nextTiles(self, now=None):
+        """
+            Returns the list of (row, col) to poll this frame
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.lastPoll is not None:
+            # smoothed, and a pause in the game does not count
+            interval = min(now - self.lastPoll, self.maxLatency)
+            self.gap = max(self.frameGap, (self.gap + interval) / 2)
+        self.lastPoll = now
+        # longest a tile may go between polls and still have a step on it reported in time
+        period = self.maxLatency - (self.debounce - 1) * self.gap
+        if len(self.polled) == 0:
+            # start as if the tiles had been polled in turn, so they do not all come due at once
+            for (i, cell) in enumerate(self.cells):
+                self.polled[cell] = now + self.gap - period * (i + 1) / len(self.cells)
+        hot = self.hotTiles(now)
+        live = self.liveTiles()
+        due = set()
+        idle = []
+        for cell in self.cells:
+            # if it is not polled now, the next chance is a gap away
+            if cell in hot or cell in live or now + self.gap - self.polled.get(cell, -math.inf) > period:
+                due.add(cell)
+            else:
+                idle.append(cell)
+        # top up with the tiles polled longest ago, so about as many come due every frame
+        share = len(self.cells) if period <= self.gap else math.ceil(len(self.cells) * self.gap / period)
+        idle.sort(key=lambda cell: self.polled.get(cell, -math.inf))
+        for cell in idle[:max(0, share - len(due))]:
+            due.add(cell)
+        for cell in due:
+            self.polled[cell] = now
+        return [cell for cell in self.cells if cell in due]
@@ -0,0 +1,147 @@
+### Counters for the traffic on each Lightsweeper serial port
+import time
+
+
+class LatencyHistogram():
+    """
+        Counts response times into fixed buckets, cheap enough to update
+        on every read
+    """
+
+    # upper bounds of the buckets in seconds, the last bucket takes the rest
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0.0
+        self.worst = 0.0
+
+    def add(self, seconds):
+        idx = 0
+        while idx < len(self.BOUNDS) and seconds > self.BOUNDS[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        self.total += seconds
+        if seconds > self.worst:
+            self.worst = seconds
+
+    def snapshot(self):
+        answered = sum(self.counts)
+        return {
+            "counts": list(self.counts),
+            "mean": self.total / answered if answered > 0 else None,
+            "worst": self.worst,
+        }
+
+
+class TileTelemetry():
+    def __init__(self):
+        self.commands = 0
+        self.queries = 0
+        self.timeouts = 0
+        self.latency = LatencyHistogram()
+
+    def snapshot(self):
+        return {
+            "commands": self.commands,
+            "queries": self.queries,
+            "timeouts": self.timeouts,
+            "latency": self.latency.snapshot(),
+        }
+
+
+class PortTelemetry():
+    """
+        Traffic counters for one port, kept by its port worker.
+
+        Only the worker thread updates them, so there are no locks. A
+        snapshot from another thread may be one command out of date.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.monotonic()
+        self.bytesWritten = 0
+        self.bytesRead = 0
+        self.commands = 0
+        self.queries = 0
+        self.timeouts = 0
+        self.staleBytes = 0
+        self.paceWait = 0.0
+        self.latency = LatencyHistogram()
+        self.tiles = dict()     # tile address -> TileTelemetry
+
+    def tile(self, address):
+        if address not in self.tiles:
+            self.tiles[address] = TileTelemetry()
+        return self.tiles[address]
+
+    def wrote(self, data):
+        """
+            Counts the bytes and the commands in a write, by tile address
+        """
+        self.bytesWritten += len(data)
+        idx = 0
+        while idx < len(data):
+            self.commands += 1
+            self.tile(data[idx] & 0xF8).commands += 1
+            # low 3 bits count the bytes after the address and command bytes
+            idx += (data[idx] & 0x07) + 2
+
+    def answered(self, request, seconds):
+        """
+            Counts a query's response, or its timeout if it has none
+        """
+        self.queries += 1
+        tile = self.tile(request.data[0] & 0xF8) if len(request.data) > 0 else None
+        if tile is not None:
+            tile.queries += 1
+        if request.response is None:
+            self.timeouts += 1
+            if tile is not None:
+                tile.timeouts += 1
+            return
+        self.bytesRead += len(request.response)
+        self.latency.add(seconds)
+        if tile is not None:
+            tile.latency.add(seconds)
+
+    def snapshot(self):
+        """
+            Returns the counters as plain dicts and lists
+        """
+        return {
+            "port": self.name,
+            "elapsed": time.monotonic() - self.started,
+            "bytesWritten": self.bytesWritten,
+            "bytesRead": self.bytesRead,
+            "commands": self.commands,
+            "queries": self.queries,
+            "timeouts": self.timeouts,
+            "staleBytes": self.staleBytes,
+            "paceWait": self.paceWait,
+            "latency": self.latency.snapshot(),
+            "tiles": {address: tile.snapshot() for (address, tile) in list(self.tiles.items())},
+        }
+
+
+def formatSnapshot(snapshot, last=None):
+    """
+        One line summary of a port snapshot, with rates since the last one
+    """
+    elapsed = snapshot["elapsed"]
+    written = snapshot["bytesWritten"]
+    read = snapshot["bytesRead"]
+    if last is not None:
+        elapsed -= last["elapsed"]
+        written -= last["bytesWritten"]
+        read -= last["bytesRead"]
+    elapsed = max(elapsed, 1e-6)
+    latency = snapshot["latency"]
+    mean = latency["mean"]
+    line = "{:s}: {:.0f} B/s out, {:.0f} B/s in, {:d} commands, {:d} queries, {:d} timeouts, {:d} stale bytes".format(
+        str(snapshot["port"]), written / elapsed, read / elapsed, snapshot["commands"],
+        snapshot["queries"], snapshot["timeouts"], snapshot["staleBytes"])
+    if mean is not None:
+        line += ", latency mean {:.1f} ms worst {:.1f} ms".format(mean * 1000, latency["worst"] * 1000)
+    return line
@@ -10,7 +10,8 @@
 
 # Consider wrapping this into LSRealFloor main
 
-import time
+from LSFrameClock import FrameClock
+from LSFrameClock import wait
 
 class TileCalibrate():
     FRAME_GAP = 1 / 30
@@ -22,14 +23,13 @@ class TileCalibrate():
         pass
 
     def beginLoop(self):
+        clock = FrameClock(self.FRAME_GAP)
         while True:
-            self.wait(self.FRAME_GAP)
+            clock.tick()
             self.enterFrame()
 
     def wait(self, seconds):
-        currentTime = time.time()
-        while time.time() - currentTime < seconds:
-            pass
+        wait(seconds)
 
     def enterFrame(self):
         sensorsChanged = self.pollSensors()
@@ -0,0 +1,385 @@
+### Simulated Lightsweeper tiles on a pseudo-terminal, for running the floor without hardware
+
+import os
+import random
+import select
+import threading
+import time
+import tty
+from collections import deque
+
+from LSRealTile import (NOP_MODE, SHOW_ADDRESS, STOP_MODE, LS_LATCH, LS_CLEAR, LS_RESET, LS_DEBUG,
+                        FLIP_ON, FLIP_OFF, LS_RANDOM_ADDRESS, LS_RANDOM_ADDRESS2,
+                        SET_COLOR, SET_SHAPE, SET_TRANSITION,
+                        COLOR_RED_MASK, COLOR_GREEN_MASK, COLOR_BLUE_MASK,
+                        ADC_NOW, ADC_MIN, ADC_MAX, ADC_THRESH, SENSOR_NOW,
+                        TILE_STATUS, TILE_VERSION, STATUS_FLIP_MASK, STATUS_ERR_MASK,
+                        EEPROM_READ, EEPROM_WRITE, EEPROM_WRITE2,
+                        EE_ADDR, EE_CONFIG,
+                        MAX_ERRORS, RETURN_ERRORS, CLEAR_ERRORS,
+                        SEGMENT_CMD, SEGMENT_CMD_END, SEGMENT_FIELD_RED, SEGMENT_FIELD_GREEN,
+                        SEGMENT_FIELD_BLUE, SEGMENT_KEEP_MASK, CONDX_MASK, CONDX_LATCH,
+                        CONDX_TRIG, CONDX_LATCH_TRIG)
+
+# what ls_bm2014 answers to TILE_VERSION
+TILE_VERSION_BYTES = bytes([0, 4])
+
+# stands in for get_free_memory() in the greeting sent at reset
+FREE_MEMORY = 0x40
+
+
+class VirtualTile():
+    """
+        One tile running the ls_bm2014 command processor.
+
+        Bytes from the bus land in a receive buffer the size of the
+        SoftwareSerial one, and bytes that arrive while it is full are lost.
+        Each call to loop() is one pass through the firmware's loop(), which
+        completes at most one command. Commands the firmware does not handle,
+        including SET_TILE and the calibration commands, go to the error queue.
+        With debug output on, each command it takes is logged as CMD_DONE and
+        then echoed, ahead of any reply.
+    """
+
+    RX_BUFFER = 32          # _SS_MAX_RX_BUFF
+    CMD_DONE = 0xCC         # what cmdRead() logs with debug on when a command is complete
+    COMMAND_TIMEOUT = 0.1   # partial commands are dropped after this long
+    IDLE_ADC = 200
+    PRESSED_ADC = 40
+
+    def __init__(self, address):
+        self.eeprom = bytearray([0xFF] * 256)
+        self.eeprom[EE_ADDR] = address
+        self.eeprom[EE_CONFIG] = 0
+        # EE_ADC_MIN and EE_ADC_MAX stay 0xFF, the firmware never writes them
+        self.rx = deque()
+        self.overruns = 0
+        self.pressed = False
+        self.reset()
+
+    def reset(self):
+        """
+            Restarts the tile as at power up and returns the greeting it sends
+        """
+        self.address = self.eeprom[EE_ADDR] & 0xF8
+        self.debug = False
+        self.status = STATUS_FLIP_MASK if self.eeprom[EE_CONFIG] & STATUS_FLIP_MASK else 0
+        self.errors = [0] * MAX_ERRORS
+        self.activeSegs = [0, 0, 0]
+        self.queuedSegs = [0, 0, 0]
+        self.triggerSegs = [0, 0, 0]
+        self.commonColor = 0
+        self.oneColorSegs = 0
+        self.sensorReadings = 0
+        # ADC statistics since reset, answered by ADC_MIN, ADC_MAX and ADC_THRESH
+        self.adcMin = self.adc()
+        self.adcMax = self.adc()
+        self.commandBytes = bytearray()
+        self.commandLength = 0
+        self.commandStart = 0
+        self.syncCount = 0
+        return bytes([FREE_MEMORY, self.eeprom[EE_ADDR]])
+
+    def press(self, pressed=True):
+        self.pressed = pressed
+
+    def adc(self):
+        return self.PRESSED_ADC if self.pressed else self.IDLE_ADC
+
+    def receive(self, byte, stamp=0):
+        """
+            Takes a byte that finished arriving on the wire at time stamp
+        """
+        if len(self.rx) >= self.RX_BUFFER:
+            self.overruns += 1
+            return
+        self.rx.append((stamp, byte))
+
+    def loop(self, now):
+        """
+            Runs one pass of the firmware loop at time now.
+            Returns the bytes the tile writes back, if any.
+        """
+        self.sensorReadings = (self.sensorReadings >> 1) | (0x80 if self.pressed else 0)
+        self.adcMin = min(self.adcMin, self.adc())
+        self.adcMax = max(self.adcMax, self.adc())
+        command = self._cmdRead(now)
+        if command is None:
+            return b''
+        out = bytearray()
+        if self.debug:
+            out.append(self.CMD_DONE)
+        return bytes(out) + self._execute(command)
+
+    def _cmdRead(self, now):
+        # cmdRead() - collects one whole command, resyncing on four zero bytes
+        # the timeout is measured on the wire, to the next byte if one is waiting,
+        # so a late pass of the simulation does not drop a command the tile would keep
+        if self.commandLength > 0:
+            lastHeard = self.rx[0][0] if len(self.rx) > 0 else now
+            if lastHeard - self.commandStart > self.COMMAND_TIMEOUT:
+                self.commandLength = 0
+                return None
+        while len(self.rx) > 0:
+            (stamp, byte) = self.rx.popleft()
+            if byte == 0:
+                self.syncCount += 1
+                if self.syncCount == 4:
+                    self.commandLength = 0
+                    self.syncCount = 0
+                    return None
+            else:
+                self.syncCount = 0
+
+            if self.commandLength == 0:
+                self.commandBytes = bytearray([byte])
+                # low 3 bits count the bytes after the address and command bytes
+                self.commandLength = (byte & 0x07) + 2
+                self.commandStart = stamp
+                continue
+
+            self.commandBytes.append(byte)
+            if len(self.commandBytes) == self.commandLength:
+                self.commandLength = 0
+                target = self.commandBytes[0] & 0xF8
+                if target == self.address or target == 0:
+                    return bytes(self.commandBytes)
+                return None
+        return None
+
+    def _execute(self, command):
+        mode = command[1]
+        out = bytearray()
+        if self.debug:
+            out.append(mode)    # dlog(mode) echoes each new command
+
+        if SEGMENT_CMD <= mode <= SEGMENT_CMD_END:
+            self._segmentCmd(mode, command)
+        elif mode == LS_LATCH:
+            self.activeSegs = list(self.queuedSegs)
+        elif mode == LS_CLEAR:
+            self.activeSegs = [0, 0, 0]
+        elif mode == LS_RESET:
+            out += self.reset()
+        elif mode in (SET_COLOR, SET_SHAPE, SET_TRANSITION):
+            self._singleColor(mode, command)
+        elif mode in (SENSOR_NOW, ADC_NOW, ADC_THRESH, ADC_MIN, ADC_MAX):
+            out.append(self._adcStat(mode))
+        elif mode == TILE_STATUS:
+            out.append(self.status)
+        elif mode == TILE_VERSION:
+            out += TILE_VERSION_BYTES
+        elif mode == LS_DEBUG:
+            self.debug = len(command) > 2 and command[2] != 0
+        elif mode == FLIP_ON:
+            self.status |= STATUS_FLIP_MASK
+        elif mode == FLIP_OFF:
+            self.status &= ~STATUS_FLIP_MASK
+        elif mode == LS_RANDOM_ADDRESS and self._checksumOk(command, 3) and command[2] == LS_RANDOM_ADDRESS2:
+            self.address = random.randrange(1, 32) << 3
+        elif mode == EEPROM_READ and len(command) > 2:
+            out.append(self.eeprom[command[2]])
+        elif mode == EEPROM_WRITE:
+            if len(command) > 5 and command[2] == EEPROM_WRITE2 and self._checksumOk(command, 5):
+                self.eeprom[command[3]] = command[4]
+            else:
+                out += self._processErrors(EEPROM_WRITE)
+        elif mode == NOP_MODE or mode <= SHOW_ADDRESS or mode == STOP_MODE:
+            pass    # test modes only change what the tile shows on its own
+        else:
+            out += self._processErrors(mode)
+        return bytes(out)
+
+    def _segmentCmd(self, mode, command):
+        # processSegmentCmd() - fields not given are cleared unless a given one has the keep bit
+        fields = list(command[2:]) + [0] * 4
+        clearOthers = True
+        idx = 0
+        for mask in (SEGMENT_FIELD_RED, SEGMENT_FIELD_GREEN, SEGMENT_FIELD_BLUE):
+            if mode & mask:
+                if fields[idx] & SEGMENT_KEEP_MASK:
+                    clearOthers = False
+                idx += 1
+
+        condx = mode & CONDX_MASK
+        if condx == CONDX_LATCH:
+            targets = [self.queuedSegs]
+        elif condx == CONDX_TRIG:
+            targets = [self.triggerSegs]
+        elif condx == CONDX_LATCH_TRIG:
+            targets = [self.queuedSegs, self.triggerSegs]
+        else:
+            targets = [self.activeSegs]
+
+        idx = 0
+        for (i, mask) in enumerate((SEGMENT_FIELD_RED, SEGMENT_FIELD_GREEN, SEGMENT_FIELD_BLUE)):
+            if mode & mask:
+                for target in targets:
+                    target[i] = fields[idx]
+                idx += 1
+            elif clearOthers:
+                for target in targets:
+                    target[i] = 0
+        # a transition field may follow, the firmware ignores it too
+
+    def _singleColor(self, mode, command):
+        # the firmware keeps the last color and shape and lights them together
+        if len(command) < 3:
+            return
+        if mode == SET_COLOR:
+            self.commonColor = command[2]
+        elif mode == SET_SHAPE:
+            self.oneColorSegs = command[2]
+        else:
+            return
+        self.activeSegs = [self.oneColorSegs if self.commonColor & mask else 0
+                           for mask in (COLOR_RED_MASK, COLOR_GREEN_MASK, COLOR_BLUE_MASK)]
+
+    def _adcStat(self, stat):
+        if stat == SENSOR_NOW:
+            val = self.sensorReadings
+            self.sensorReadings = 0xFF if self.sensorReadings >= 128 else 0
+            return val
+        if stat == ADC_MIN:
+            return self.adcMin
+        if stat == ADC_MAX:
+            return self.adcMax
+        if stat == ADC_THRESH:
+            return (self.adcMin + self.adcMax) // 2
+        return self.adc()
+
+    def _checksumOk(self, command, count):
+        return len(command) > count and sum(command[1:count + 1]) % 256 == 0
+
+    def _processErrors(self, mode):
+        out = bytearray()
+        if mode == RETURN_ERRORS:
+            out += bytes(self.errors)
+        if mode in (RETURN_ERRORS, CLEAR_ERRORS):
+            self.errors = [0] * MAX_ERRORS
+            self.status &= ~STATUS_ERR_MASK
+        elif mode != NOP_MODE:
+            # most recent error first
+            self.errors = [mode] + self.errors[:-1]
+            self.status |= STATUS_ERR_MASK
+            if self.debug:
+                out.append(0xFF)
+        return out
+
+
+class LSVirtualBus():
+    """
+        A pseudo-terminal with simulated tiles on the far end. Open port with
+        pyserial, or name it in a .floor file, and drive it like a real bus.
+
+        Bytes cross the wire at the bus baud rate in both directions, each tile
+        runs its loop every loopTime seconds, and tile replies share one line
+        back to the host, so timing and buffer overruns behave like the floor.
+    """
+
+    LOOP_TIME = 0.001   # one pass of the tile loop: ADC smoothing, one command, display
+    MAX_CATCH_UP = 0.05 # longest stall of this thread that missed loop passes are run for
+
+    def __init__(self, addresses=(8, 16, 24, 32), baud=19200, loopTime=LOOP_TIME):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.byteTime = 10 / baud   # start bit, 8 data bits, stop bit
+        self.loopTime = loopTime
+        self.tiles = dict()
+        for address in addresses:
+            self.tiles[address] = VirtualTile(address)
+        self.toTiles = deque()      # (time the byte is on the tiles' line, byte)
+        self.toHost = deque()       # (time the byte reaches the host, byte)
+        self.hostLineFree = 0
+        self.tileLineFree = 0
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="LSVirtualBus " + self.port)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tile(self, address):
+        return self.tiles[address]
+
+    def press(self, address, pressed=True):
+        with self.lock:
+            self.tiles[address].press(pressed)
+
+    def overruns(self):
+        """
+            Returns the bytes each tile has dropped from a full receive buffer
+        """
+        with self.lock:
+            return {address: tile.overruns for (address, tile) in self.tiles.items()}
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def _run(self):
+        nextLoop = time.monotonic()
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            due = [nextLoop]
+            if len(self.toTiles) > 0:
+                due.append(self.toTiles[0][0])
+            if len(self.toHost) > 0:
+                due.append(self.toHost[0][0])
+            timeout = min(max(0, min(due) - now), 0.01)
+            (readable, _, _) = select.select([self.master], [], [], timeout)
+            now = time.monotonic()
+            if readable:
+                self._hostWrote(os.read(self.master, 1024), now)
+
+            with self.lock:
+                # run the loop passes that came due while this thread was not running, each
+                # one after just the bytes that had arrived by then, as the tiles would have
+                nextLoop = max(nextLoop, now - self.MAX_CATCH_UP)
+                while nextLoop <= now:
+                    self._deliver(nextLoop)
+                    for tile in self.tiles.values():
+                        self._tileWrote(tile.loop(nextLoop), nextLoop)
+                    nextLoop += self.loopTime
+                self._deliver(now)
+
+            out = bytearray()
+            while len(self.toHost) > 0 and self.toHost[0][0] <= now:
+                out.append(self.toHost.popleft()[1])
+            if len(out) > 0:
+                os.write(self.master, out)
+
+    def _deliver(self, now):
+        while len(self.toTiles) > 0 and self.toTiles[0][0] <= now:
+            (stamp, byte) = self.toTiles.popleft()
+            for tile in self.tiles.values():
+                tile.receive(byte, stamp)
+
+    def _hostWrote(self, data, now):
+        # the host's bytes queue up behind each other on the wire
+        for byte in data:
+            self.hostLineFree = max(self.hostLineFree, now) + self.byteTime
+            self.toTiles.append((self.hostLineFree, byte))
+
+    def _tileWrote(self, data, now):
+        for byte in data:
+            self.tileLineFree = max(self.tileLineFree, now) + self.byteTime
+            self.toHost.append((self.tileLineFree, byte))
+
+
+def main():
+    print("\nSimulated Lightsweeper bus")
+    bus = LSVirtualBus()
+    print("Tiles " + repr(sorted(bus.tiles.keys())) + " are listening on " + bus.port)
+    print("Use the port in a .floor file or open it with pyserial, <Enter> to stop")
+    try:
+        input()
+    finally:
+        bus.close()
+
+
+if __name__ == '__main__':
+
+    main()
@@ -1,5 +1,7 @@
 class Move():
-    def __init__(self, row, col, val):
+    # pressed is False when the move is someone stepping off the tile
+    def __init__(self, row, col, val, pressed=True):
         self.row = row
         self.col = col
         self.val = val
+        self.pressed = pressed
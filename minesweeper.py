@@ -6,7 +6,7 @@ from board import Board
 import Colors
 import Shapes
 from Frame import Frame
-import time
+from LSFrameClock import wait
 
 class Minesweeper():
     def __init__(self, display, audio, rows, cols):
@@ -36,6 +36,8 @@ class Minesweeper():
     def heartbeat(self, sensorsChanged):
         if self.board.is_playing:
             for move in sensorsChanged:
+                if not move.pressed:
+                    continue
                 if self.songsQuiet:
                     self.songsQuiet = True
                 self.audio.playSound("Blop.wav")
@@ -62,10 +64,11 @@ class Minesweeper():
                 self.ended = True
         #push changed tiles to display
 
-    # currently this is just iterating across all the cells in the internal game state and pushing
-    # the corresponding shape/color to the display for the given tile's position. a slightly better design would
-    # be to only need to push info for the tiles that have actually changed
+    # iterates across all the cells in the internal game state and pushes the corresponding
+    # shape/color to the display for the given tile's position. the display keeps a shadow
+    # framebuffer and only sends the tiles that actually changed to the floors
     def updateBoard(self, board):
+        hidden = []
         for row in range(0, self.rows):
             for col in range(0, self.cols):
                 if board != None:
@@ -73,6 +76,7 @@ class Minesweeper():
                     if cell == "D":
                         self.display.set(row, col, Shapes.DASH, Colors.VIOLET)
                     elif cell == '.':
+                        hidden.append((row, col))
                         self.display.set(row, col, Shapes.ZERO, Colors.GREEN)
                     elif cell == ' ' or cell == '':
                         self.display.set(row, col, Shapes.DASH, Colors.BLACK)
@@ -82,8 +86,24 @@ class Minesweeper():
                         break
                     else:
                         self.display.set(row, col, Shapes.digitToHex(int(cell)), Colors.YELLOW)
+        # only hidden cells do anything when stepped on, and the ones next to a revealed
+        # cell are where the players are, the rest are polled round robin
+        liveTiles = []
+        if board != None:
+            for (row, col) in hidden:
+                if self.nextToRevealed(board, row, col):
+                    liveTiles.append((row, col))
+        self.display.setLiveTiles(liveTiles)
         return
 
+    # true if any cell around this one, diagonals included, has been revealed
+    def nextToRevealed(self, board, row, col):
+        for r in range(max(0, row - 1), min(self.rows, row + 2)):
+            for c in range(max(0, col - 1), min(self.cols, col + 2)):
+                if board.getCellState(r, c) not in ('.', 'F'):
+                    return True
+        return False
+
     def ended(self):
         return self.ended
 
@@ -159,9 +179,3 @@ class EndAnimation:
         else:
             self.currentFrame = self.frames.pop()
         return self.currentFrame
-
-def wait(seconds):
-    # self.pollSensors()
-    currentTime = time.time()
-    while time.time() - currentTime < seconds:
-        pass
\ No newline at end of file
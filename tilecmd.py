@@ -59,7 +59,8 @@ if __name__ == '__main__':
 
 # Select com port
 
-    lsls = lsOpen()
+    # scan every port, the saved map would hide tiles added since it was saved
+    lsls = lsOpen(useCache=False)
    # print(lsls.lsMatrix) # Debugging
 
     if args['-p']: